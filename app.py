@@ -17,13 +17,15 @@ import io
 # Import modules
 from auth import login_user, register_user, hash_password
 from database import init_db
+from notification_outbox import start_outbox_worker
+from summary_jobs import start_summary_worker
 from referral import create_referral, get_referrals_for_doctor, get_referral_details
 from consultation import submit_consultation
 from analytics import get_user_analytics, get_referral_analytics, get_doctor_performance_analytics
-from email_service import send_referral_notification, send_consultation_notification
+from email_service import send_referral_notification, send_consultation_notification, set_preview_sink
 from ui import (render_login_page, render_dashboard, render_dashboard_home, 
                render_create_referral, render_view_referrals, render_view_consultations,
-               render_analytics, render_profile, render_referral_details)
+               render_analytics, render_profile, render_referral_details, streamlit_preview_sink)
 from styles import apply_page_styling  # Import styling function
 
 # Initialize session state for pages
@@ -54,6 +56,15 @@ def main():
     # Initialize database
     init_db()
     
+    # Show email previews in the UI; the outbox worker runs without a session and is skipped
+    set_preview_sink(streamlit_preview_sink)
+    
+    # Deliver queued email notifications in the background
+    start_outbox_worker()
+    
+    # Generate AI referral summaries in the background
+    start_summary_worker()
+    
     # Render the appropriate page based on the session state
     if not st.session_state.logged_in:
         render_login_page()
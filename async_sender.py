@@ -0,0 +1,151 @@
+import asyncio
+import sqlite3
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from email_service import EMAIL_POOL_SIZE
+from notification_outbox import (_claim_batch, _record_result, deliver_notification, process_digests,
+                                 requeue_stale, EMAIL_DIGEST_WINDOW_MINUTES)
+
+# Concurrent senders write their results at the same time; wait for the lock instead of failing
+DB_LOCK_TIMEOUT = 30
+
+def _claim(batch_size, db_path):
+    """Claim a batch of due outbox rows on a short-lived connection."""
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=DB_LOCK_TIMEOUT)
+    try:
+        return _claim_batch(conn, batch_size)
+    finally:
+        conn.close()
+
+def _deliver(row):
+    """Deliver one claimed outbox row. Returns (outbox_id, error or None)."""
+    outbox_id, kind, recipient, payload = row
+    try:
+        deliver_notification(kind, recipient, json.loads(payload))
+        return outbox_id, None
+    except Exception as e:
+        return outbox_id, e
+
+def _record_results(results, db_path):
+    """Record a batch of delivery outcomes in one transaction."""
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=DB_LOCK_TIMEOUT)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        sent = [outbox_id for outbox_id, error in results if error is None]
+        if sent:
+            _record_result(conn, sent)
+        for outbox_id, error in results:
+            if error is not None:
+                _record_result(conn, [outbox_id], error)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+async def drain_outbox_async(concurrency=EMAIL_POOL_SIZE, batch_size=100, db_path='referral_system.db'):
+    """
+    Deliver every due outbox notification concurrently.
+
+    A producer claims rows from the outbox into a bounded asyncio queue and
+    `concurrency` consumers deliver them on a thread executor. Each claim
+    takes at most the free room in the queue, so rows are only claimed as
+    fast as they are sent: at most 3 * concurrency rows are in 'sending' at
+    any time, which bounds what an interrupted run leaves for
+    requeue_stale().
+    Outcomes are written back in batches by a single recorder, so senders
+    never contend for the SQLite write lock.
+    The number of SMTP sessions is bounded by the shared SMTP pool
+    (EMAIL_POOL_SIZE) and the send rate by the provider rate limiter, so
+    raise those together with concurrency when draining a large backlog.
+
+    Parameters:
+    - concurrency: Number of notifications in flight at once
+    - batch_size: Most rows claimed from the outbox per query (also limited by the free queue room)
+    - db_path: SQLite database holding the outbox
+
+    Returns:
+    - dict: sent, failed, elapsed seconds and messages per second
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    space = asyncio.Event()  # set whenever a consumer takes a row off the queue
+    results = asyncio.Queue()
+    stats = {'sent': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=DB_LOCK_TIMEOUT)
+    try:
+        requeue_stale(conn)
+    finally:
+        conn.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency + 2, thread_name_prefix="outbox-send") as executor:
+
+        async def producer():
+            while True:
+                # Wait for half the queue to be free, so claims stay batched rather than a row at a time
+                free = queue.maxsize - queue.qsize()
+                if free < max(1, queue.maxsize // 2):
+                    space.clear()
+                    await space.wait()
+                    continue
+                # Only the producer adds rows, so the room counted above is still free after the claim
+                rows = await loop.run_in_executor(executor, _claim, min(batch_size, free), db_path)
+                if not rows:
+                    break
+                for row in rows:
+                    queue.put_nowait(row)
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def consumer():
+            while True:
+                row = await queue.get()
+                space.set()
+                if row is None:
+                    return
+                await results.put(await loop.run_in_executor(executor, _deliver, row))
+
+        async def recorder():
+            done = False
+            while not done:
+                batch = [await results.get()]
+                while not results.empty():
+                    batch.append(results.get_nowait())
+                if batch[-1] is None:
+                    done = True
+                    batch.pop()
+                if batch:
+                    await loop.run_in_executor(executor, _record_results, batch, db_path)
+                    for _, error in batch:
+                        stats['sent' if error is None else 'failed'] += 1
+
+        recording = asyncio.ensure_future(recorder())
+        await asyncio.gather(producer(), *[consumer() for _ in range(concurrency)])
+        await results.put(None)
+        await recording
+
+        if EMAIL_DIGEST_WINDOW_MINUTES > 0:
+            stats['sent'] += await loop.run_in_executor(executor, process_digests, None, db_path)
+
+    elapsed = time.perf_counter() - start
+    stats['elapsed'] = elapsed
+    stats['rate'] = (stats['sent'] + stats['failed']) / elapsed if elapsed else 0
+    return stats
+
+def drain_outbox(concurrency=EMAIL_POOL_SIZE, batch_size=100, db_path='referral_system.db'):
+    """Synchronous entry point for drain_outbox_async()."""
+    return asyncio.run(drain_outbox_async(concurrency, batch_size, db_path))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drain the email outbox with concurrent SMTP sessions.")
+    parser.add_argument("--concurrency", type=int, default=EMAIL_POOL_SIZE,
+                        help="Notifications in flight at once (SMTP sessions are capped by EMAIL_POOL_SIZE)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Rows claimed from the outbox per query")
+    args = parser.parse_args()
+
+    result = drain_outbox(args.concurrency, args.batch_size)
+    print(f"Sent {result['sent']}, failed {result['failed']} in {result['elapsed']:.1f}s "
+          f"({result['rate']:.1f} msg/s)")
@@ -0,0 +1,166 @@
+import sqlite3
+import os
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from database import MISSING_SUMMARY_SQL
+from gpt_tools import get_gpt4_summary
+from circuit_breaker import CircuitOpenError
+from rate_limit import get_rate_limiter
+from summary_jobs import build_summary_input, summary_input_hash
+
+# Load environment variables
+load_dotenv()
+
+# Requests per minute allowed by the OpenAI account; the backfill stays under it
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 60))
+LLM_REQUEST_BURST = int(os.getenv("LLM_REQUEST_BURST", 5))
+
+CHECKPOINT_FILE = 'summary_backfill_checkpoint.json'
+DB_LOCK_TIMEOUT = 30
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    """Return the saved progress, or a fresh one if there is no checkpoint."""
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'last_id': 0, 'succeeded': 0, 'failed': 0}
+
+def save_checkpoint(checkpoint, path=CHECKPOINT_FILE):
+    """Write the checkpoint atomically so an interrupted run never leaves a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def count_missing(conn, after_id=0):
+    """Number of referrals after after_id still missing a summary."""
+    return conn.execute(f'''
+    SELECT COUNT(*) FROM referrals
+    WHERE {MISSING_SUMMARY_SQL} AND id > ? AND (gpt_summary_status IS NULL OR gpt_summary_status != 'pending')
+    ''', (after_id,)).fetchone()[0]
+
+def find_missing(conn, after_id, limit):
+    """Next page of referrals missing a summary, in id order (keyset pagination over the partial index)."""
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute(f'''
+        SELECT * FROM referrals
+        WHERE {MISSING_SUMMARY_SQL} AND id > ? AND (gpt_summary_status IS NULL OR gpt_summary_status != 'pending')
+        ORDER BY id
+        LIMIT ?
+        ''', (after_id, limit))]
+    finally:
+        conn.row_factory = None
+
+def summarize_referral(referral, limiter, db_path='referral_system.db'):
+    """
+    Generate and store the summary for one referral.
+
+    Returns:
+    - bool: True if the summary was stored
+    """
+    summary_input = build_summary_input(referral)
+    while True:
+        limiter.acquire()
+        try:
+            summary = get_gpt4_summary(summary_input, raise_errors=True)
+            break
+        except CircuitOpenError as e:
+            # Pause while the provider is failing instead of burning through the remaining rows
+            print(f"LLM circuit open, backfill paused for {e.retry_after:.0f}s")
+            time.sleep(e.retry_after + random.uniform(0, 1))
+        except Exception as e:
+            print(f"Backfill failed for referral {referral['referral_id']}: {e}")
+            return False
+
+    conn = sqlite3.connect(db_path, timeout=DB_LOCK_TIMEOUT)
+    try:
+        conn.execute('''
+        UPDATE referrals SET gpt_summary = ?, gpt_summary_status = 'ready', gpt_summary_hash = ?
+        WHERE id = ?
+        ''', (summary, summary_input_hash(summary_input), referral['id']))
+        conn.commit()
+    finally:
+        conn.close()
+    return True
+
+def backfill_summaries(workers=4, batch_size=50, limit=None, restart=False,
+                       checkpoint_path=CHECKPOINT_FILE, db_path='referral_system.db'):
+    """
+    Generate summaries for referrals that never got one.
+
+    Pages through the missing rows in id order and summarizes each page on
+    a bounded worker pool, with API calls throttled by a shared token
+    bucket. The highest id of every finished page is checkpointed, so an
+    interrupted run resumes after the last complete page; rows that failed
+    are retried by running again with restart.
+
+    Parameters:
+    - workers: Concurrent API calls
+    - batch_size: Referrals fetched and checkpointed per page
+    - limit: Stop after this many referrals (None for all)
+    - restart: Ignore the checkpoint and start from the first referral
+    - checkpoint_path: File holding the progress
+    - db_path: SQLite database
+
+    Returns:
+    - dict: The final checkpoint (last_id, succeeded, failed)
+    """
+    checkpoint = {'last_id': 0, 'succeeded': 0, 'failed': 0} if restart else load_checkpoint(checkpoint_path)
+    limiter = get_rate_limiter('openai', LLM_REQUESTS_PER_MINUTE / 60, LLM_REQUEST_BURST)
+
+    conn = sqlite3.connect(db_path)
+    total = count_missing(conn, checkpoint['last_id'])
+    if limit is not None:
+        total = min(total, limit)
+    print(f"{total} referrals to backfill, resuming after id {checkpoint['last_id']}")
+
+    done = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary-backfill") as executor:
+            while done < total:
+                page = find_missing(conn, checkpoint['last_id'], min(batch_size, total - done))
+                if not page:
+                    break
+
+                results = list(executor.map(lambda referral: summarize_referral(referral, limiter, db_path), page))
+
+                done += len(page)
+                checkpoint['last_id'] = page[-1]['id']
+                checkpoint['succeeded'] += sum(results)
+                checkpoint['failed'] += len(results) - sum(results)
+                save_checkpoint(checkpoint, checkpoint_path)
+
+                elapsed = time.perf_counter() - start
+                rate = done / elapsed if elapsed else 0
+                eta = (total - done) / rate if rate else 0
+                print(f"{done}/{total} referrals ({rate:.2f}/s, ETA {eta:.0f}s), "
+                      f"{checkpoint['succeeded']} succeeded, {checkpoint['failed']} failed")
+    finally:
+        conn.close()
+
+    return checkpoint
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate missing AI summaries for existing referrals.")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent API calls")
+    parser.add_argument("--batch-size", type=int, default=50, help="Referrals per checkpointed page")
+    parser.add_argument("--limit", type=int, help="Stop after this many referrals")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the referrals missing a summary")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        conn = sqlite3.connect('referral_system.db')
+        print(f"{count_missing(conn)} referrals are missing an AI summary")
+        plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT id FROM referrals WHERE {MISSING_SUMMARY_SQL} AND id > 0 ORDER BY id")
+        print("Query plan:", "; ".join(row[-1] for row in plan))
+        conn.close()
+    else:
+        backfill_summaries(args.workers, args.batch_size, args.limit, args.restart)
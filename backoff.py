@@ -0,0 +1,12 @@
+import random
+
+def retry_delay(attempts, base_seconds, max_seconds):
+    """
+    Seconds to wait before the next attempt: capped exponential backoff with equal jitter.
+
+    The delay is drawn between half and all of base_seconds * 2 ** (attempts - 1),
+    capped at max_seconds, so retries of jobs that failed together spread out
+    while each still waits at least half the backoff.
+    """
+    ceiling = min(max_seconds, base_seconds * 2 ** max(0, attempts - 1))
+    return random.uniform(ceiling / 2, ceiling)
@@ -0,0 +1,89 @@
+"""
+Time to drain an outbox backlog: sequential worker vs. the concurrent sender.
+
+Seeds a scratch database with queued referral notifications and delivers
+them to a local SMTP sink that adds a per-message delay, standing in for a
+provider's acceptance latency:
+
+    python benchmarks/bench_async_sender.py --notifications 2000 --concurrency 16
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from smtp_sink import SMTPSink
+
+def seed(notifications):
+    """Create referral_system.db in the current directory with a queued backlog."""
+    from database import init_db
+    init_db()
+
+    conn = sqlite3.connect('referral_system.db')
+    c = conn.cursor()
+    c.execute('''
+    INSERT INTO users (username, password, email, full_name, role)
+    VALUES ('bench', 'x', 'bench@localhost', 'Bench Doctor', 'Referring Doctor')
+    ''')
+    for i in range(notifications):
+        referral_id = f"bench-{i}"
+        c.execute('''
+        INSERT INTO referrals (referral_id, referring_doctor_id, referred_doctor_email, patient_name,
+                               patient_age, patient_gender, patient_id, clinical_information,
+                               reason_for_referral, urgency)
+        VALUES (?, 1, ?, ?, 50, 'Female', ?, 'Clinical notes', 'Assessment', 'Routine')
+        ''', (referral_id, f"doctor{i}@localhost", f"Patient {i}", f"P{i}"))
+        c.execute("INSERT INTO email_outbox (kind, recipient, payload) VALUES ('referral', ?, ?)",
+                  (f"doctor{i}@localhost", json.dumps({'referral_id': referral_id, 'urgency': 'Routine'})))
+    conn.commit()
+    conn.close()
+
+def requeue_all():
+    conn = sqlite3.connect('referral_system.db')
+    conn.execute("UPDATE email_outbox SET status = 'queued', attempts = 0, sent_at = NULL")
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notifications", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent senders (and SMTP pool size)")
+    parser.add_argument("--message-delay", type=float, default=0.02, help="Simulated provider seconds per message")
+    args = parser.parse_args()
+
+    sink = SMTPSink(message_delay=args.message_delay).start()
+
+    # email_service reads its configuration at import time
+    os.environ.update({
+        "EMAIL_SERVER": "127.0.0.1", "EMAIL_PORT": str(sink.port), "EMAIL_USE_TLS": "false",
+        "EMAIL_USERNAME": "bench@localhost", "EMAIL_POOL_SIZE": str(args.concurrency),
+        "EMAIL_RATE_LIMIT_PER_SECOND": "100000", "EMAIL_RATE_LIMIT_BURST": "100000",
+        "EMAIL_DIGEST_WINDOW_MINUTES": "0",
+    })
+
+    os.chdir(tempfile.mkdtemp())
+    seed(args.notifications)
+
+    from notification_outbox import process_outbox
+    from async_sender import drain_outbox
+
+    start = time.perf_counter()
+    while process_outbox():
+        pass
+    sequential = time.perf_counter() - start
+    print(f"sequential {args.notifications} notifications in {sequential:.2f}s "
+          f"-> {args.notifications / sequential:.1f} msg/s")
+
+    requeue_all()
+    result = drain_outbox(args.concurrency)
+    print(f"concurrent {result['sent']} sent, {result['failed']} failed in {result['elapsed']:.2f}s "
+          f"-> {result['rate']:.1f} msg/s")
+
+    print(f"Speedup: {sequential / result['elapsed']:.1f}x, sink received {sink.messages} messages")
+    sink.shutdown()
@@ -0,0 +1,62 @@
+"""
+Render throughput of the precompiled email templates.
+
+    python benchmarks/bench_email_templates.py --renders 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_templates import (render_template, render_fragment, SafeHTML, DIGEST_ROW,
+                             urgency_class, status_class)
+
+def referral_context(i):
+    return {
+        'referring_doctor': f"Smith <{i}>",
+        'referral_id': f"00000000-0000-0000-0000-{i:012d}",
+        'patient_name': f"Patient {i} & Family",
+        'priority_class': urgency_class('Urgent'),
+        'urgency': 'Urgent',
+        'reason_for_referral': "Persistent chest pain on exertion, ECG changes" * 3
+    }
+
+def consultation_context(i):
+    return {
+        'referring_doctor': f"Smith {i}",
+        'consulting_doctor': f"Jones {i}",
+        'referral_id': f"00000000-0000-0000-0000-{i:012d}",
+        'patient_name': f"Patient {i}",
+        'status_class': status_class('Completed'),
+        'status': 'Completed',
+        'additional_information': SafeHTML('')
+    }
+
+def digest_context(i, size=20):
+    rows = "".join(render_fragment(DIGEST_ROW, {
+        'patient_name': f"Patient {i}-{j}",
+        'priority_class': urgency_class('Routine'),
+        'urgency': 'Routine',
+        'referring_doctor': f"Smith {j}",
+        'reason_for_referral': "Screening follow-up"
+    }) for j in range(size))
+    return {'count': size, 'rows': SafeHTML(rows)}
+
+def run(name, build_context, renders):
+    contexts = [build_context(i) for i in range(renders)]
+    start = time.perf_counter()
+    for context in contexts:
+        render_template(name, context)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {renders} renders in {elapsed:.3f}s -> {renders / elapsed:,.0f} renders/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=20000)
+    args = parser.parse_args()
+
+    run('referral', referral_context, args.renders)
+    run('consultation', consultation_context, args.renders)
+    run('referral_digest', digest_context, args.renders // 10)
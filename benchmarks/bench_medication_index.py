@@ -0,0 +1,103 @@
+"""
+Lookup latency of the local medication index.
+
+Builds an index from a synthetic OpenFDA NDC bulk file (or a real
+download passed with --dump) and times prefix, multi-word and
+misspelled searches:
+
+    python benchmarks/bench_medication_index.py --products 100000
+    python benchmarks/bench_medication_index.py --dump drug-ndc-0001-of-0001.json.zip
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from medication_index import build_index, load_index
+
+SYLLABLES = ["met", "for", "min", "ator", "va", "sta", "tin", "lis", "ino", "pril", "am", "lo",
+             "di", "pine", "pro", "zole", "ome", "gaba", "pen", "cef", "ox", "cil", "lin", "mab"]
+FORMS = ["TABLET", "CAPSULE", "INJECTION, SOLUTION", "TABLET, FILM COATED", "SUSPENSION"]
+
+def synthetic_dump(path, products):
+    """Write an NDC-style bulk file with random drug names."""
+    rng = random.Random(42)
+    generics = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).upper()
+                for _ in range(products // 5)]
+    results = []
+    for i in range(products):
+        generic = rng.choice(generics)
+        results.append({
+            "brand_name": generic.title() if rng.random() < 0.5 else f"Brand{i % 5000}",
+            "generic_name": f"{generic} HYDROCHLORIDE" if rng.random() < 0.3 else generic,
+            "dosage_form": rng.choice(FORMS),
+            "route": ["ORAL"],
+            "active_ingredients": [{"name": generic, "strength": f"{rng.choice([5, 10, 20, 50, 500])} mg/1"}]
+        })
+    with open(path, 'w') as f:
+        json.dump({"meta": {}, "results": results}, f)
+    return generics
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100000, help="Synthetic NDC products")
+    parser.add_argument("--dump", help="Real OpenFDA bulk file to index instead")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    index_path = os.path.join(workdir, "medication_index.json")
+    if args.dump:
+        dump_path, generics = args.dump, ["metformin", "atorvastatin", "lisinopril", "amoxicillin"]
+    else:
+        dump_path = os.path.join(workdir, "ndc.json")
+        generics = [g.lower() for g in synthetic_dump(dump_path, args.products)]
+
+    start = time.perf_counter()
+    count = build_index([dump_path], index_path)
+    print(f"Built index of {count} medications in {time.perf_counter() - start:.2f}s "
+          f"({os.path.getsize(index_path) / 1024 / 1024:.1f} MB)")
+
+    start = time.perf_counter()
+    index = load_index(index_path)
+    print(f"Loaded index in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    rng = random.Random(7)
+    queries = []
+    for _ in range(args.queries):
+        name = rng.choice(generics)
+        queries.append(name[:rng.randint(3, len(name))] if rng.random() < 0.7 else f"{name[:4]} hydro")
+
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{len(queries)} searches: p50 {percentile(timings, 0.5):.3f} ms, "
+          f"p99 {percentile(timings, 0.99):.3f} ms, max {max(timings):.3f} ms")
+
+    # Misspelled names: a swap, deletion or substitution in a word of at least six letters
+    index.search("qqqq")  # builds the trigram index
+    timings, found = [], 0
+    names = [name for name in generics if len(name) >= 6]
+    for _ in range(args.queries):
+        name = rng.choice(names)
+        i = rng.randrange(1, len(name) - 1)
+        typo = rng.choice([name[:i] + name[i + 1] + name[i] + name[i + 2:], name[:i] + name[i + 1:],
+                           name[:i] + rng.choice("aeiou") + name[i + 1:]])
+        start = time.perf_counter()
+        results = index.search(typo)
+        timings.append((time.perf_counter() - start) * 1000)
+        found += any(result['name'].lower().startswith(name) for result in results)
+    print(f"{len(timings)} misspelled searches: p50 {percentile(timings, 0.5):.3f} ms, "
+          f"p99 {percentile(timings, 0.99):.3f} ms, intended name found in {found / len(timings):.0%}")
@@ -0,0 +1,70 @@
+"""
+Parsing time of large OpenFDA label responses.
+
+Compares the previous nested-loop parser (brand x generic x strength x
+form expansion with a linear duplicate scan per result) with
+MedicationResults on synthetic label responses:
+
+    python benchmarks/bench_medication_results.py --records 200 --names 8 --strengths 6
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from openfda_client import _parse_label_results
+
+def previous_parse(data):
+    """The label parser as it was before MedicationResults, without its per-result logging."""
+    results = []
+    for result in data['results']:
+        if 'openfda' in result:
+            brand_names = result['openfda'].get('brand_name', ["Unknown"])
+            generic_names = result['openfda'].get('generic_name', [""])
+            dosage_forms = result['openfda'].get('dosage_form', ["Tablet"])
+            strengths = result['openfda'].get('strength', ["N/A"])
+            for brand_name in brand_names:
+                for generic_name in generic_names:
+                    name = f"{brand_name} ({generic_name})" if generic_name else brand_name
+                    dosages = []
+                    for strength in strengths:
+                        for form in dosage_forms:
+                            dosages.append(f"{strength} {form}")
+                    if not any(res["name"] == name for res in results):
+                        results.append({"name": name, "dosages": dosages, "route": "Oral"})
+    return results
+
+def label_response(records, names, strengths):
+    return {"results": [{
+        "openfda": {
+            "brand_name": [f"Brand{i}-{j}" for j in range(names)],
+            "generic_name": [f"GENERIC{i}-{j}" for j in range(names + 1)],
+            "strength": [f"{5 * (k + 1)} mg" for k in range(strengths)],
+            "dosage_form": ["TABLET", "TABLET, FILM COATED", "CAPSULE"],
+            "route": ["ORAL"]
+        }
+    } for i in range(records)]}
+
+def timed(func, data):
+    start = time.perf_counter()
+    results = func(data)
+    return time.perf_counter() - start, results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200, help="Label records per response")
+    parser.add_argument("--names", type=int, default=8, help="Brand names per record")
+    parser.add_argument("--strengths", type=int, default=6, help="Strengths per record")
+    args = parser.parse_args()
+
+    for records in (args.records // 10, args.records // 2, args.records):
+        data = label_response(records, args.names, args.strengths)
+        old_time, old_results = timed(previous_parse, data)
+        new_time, new_results = timed(_parse_label_results, data)
+        print(f"{records} records: previous {old_time * 1000:.1f} ms ({len(old_results)} results, "
+              f"{sum(len(r['dosages']) for r in old_results)} dosages), "
+              f"MedicationResults {new_time * 1000:.1f} ms ({len(new_results)} results, "
+              f"{sum(len(r['dosages']) for r in new_results)} dosages)")
@@ -0,0 +1,60 @@
+"""
+Throughput of per-message SMTP sessions vs. the pooled client.
+
+Runs against a local SMTP sink, which can add an artificial handshake delay
+to stand in for the TCP connect, STARTTLS and login of a real provider:
+
+    python benchmarks/bench_smtp_pool.py --messages 500 --connect-delay 0.05
+"""
+import argparse
+import os
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_pool import SMTPConnectionPool
+from smtp_sink import SMTPSink
+
+def build_message(i):
+    msg = MIMEText(f"Benchmark message {i}\n" + "x" * 2000)
+    msg['From'] = "bench@localhost"
+    msg['To'] = f"doctor{i}@localhost"
+    msg['Subject'] = f"Benchmark {i}"
+    return msg
+
+def send_unpooled(port, msg):
+    """Previous send_email behaviour: one session per message."""
+    server = smtplib.SMTP("127.0.0.1", port)
+    server.send_message(msg)
+    server.quit()
+
+def run(label, send, messages, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, [build_message(i) for i in range(messages)]))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {messages} messages in {elapsed:.2f}s -> {messages / elapsed:.1f} msg/s")
+    return elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent senders (and pool size)")
+    parser.add_argument("--connect-delay", type=float, default=0.02, help="Simulated handshake seconds")
+    args = parser.parse_args()
+
+    sink = SMTPSink(connect_delay=args.connect_delay).start()
+
+    unpooled = run("unpooled", lambda msg: send_unpooled(sink.port, msg), args.messages, args.threads)
+
+    pool = SMTPConnectionPool("127.0.0.1", sink.port, use_tls=False, max_size=args.threads)
+    pooled = run("pooled", pool.send_message, args.messages, args.threads)
+    pool.close_all()
+
+    print(f"Speedup: {unpooled / pooled:.1f}x, sessions opened: {pool.stats['connects']}, "
+          f"sink received {sink.messages} messages")
+    sink.shutdown()
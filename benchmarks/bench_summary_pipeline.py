@@ -0,0 +1,85 @@
+"""
+Load test of AI summary generation with the offline stub LLM provider.
+
+Seeds a scratch database with referrals, then generates their summaries
+with the sequential background job worker and with the concurrent
+backfill command. No API key or network access is needed:
+
+    python benchmarks/bench_summary_pipeline.py --referrals 200 --latency-ms 400 --workers 8
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def seed(referrals):
+    """Create referral_system.db in the current directory with referrals that have no summary."""
+    from database import init_db
+    init_db()
+
+    conn = sqlite3.connect('referral_system.db')
+    c = conn.cursor()
+    c.execute('''
+    INSERT INTO users (username, password, email, full_name, role)
+    VALUES ('bench', 'x', 'bench@localhost', 'Bench Doctor', 'Referring Doctor')
+    ''')
+    for i in range(referrals):
+        c.execute('''
+        INSERT INTO referrals (referral_id, referring_doctor_id, referred_doctor_email, patient_name,
+                               patient_age, patient_gender, patient_id, clinical_information,
+                               reason_for_referral, urgency)
+        VALUES (?, 1, 'doctor@localhost', ?, 50, 'Female', ?, ?, 'Assessment', 'Routine')
+        ''', (f"bench-{i}", f"Patient {i}", f"P{i}", f"Case {i}: intermittent chest pain on exertion"))
+    conn.commit()
+    conn.close()
+
+def reset_summaries():
+    conn = sqlite3.connect('referral_system.db')
+    conn.execute("UPDATE referrals SET gpt_summary = NULL, gpt_summary_status = NULL, gpt_summary_hash = NULL")
+    conn.execute("DELETE FROM summary_jobs")
+    conn.execute("DELETE FROM llm_cache")
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--referrals", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=300, help="Stub latency per completion")
+    parser.add_argument("--workers", type=int, default=8, help="Backfill worker pool size")
+    args = parser.parse_args()
+
+    # Modules read their configuration at import time
+    os.environ.update({"LLM_PROVIDER": "stub", "LLM_STUB_LATENCY_MS": str(args.latency_ms),
+                       "LLM_REQUESTS_PER_MINUTE": "100000", "LLM_REQUEST_BURST": "1000"})
+
+    os.chdir(tempfile.mkdtemp())
+    seed(args.referrals)
+
+    from summary_jobs import enqueue_summary, process_summary_jobs
+    from backfill_summaries import backfill_summaries
+
+    conn = sqlite3.connect('referral_system.db')
+    for (referral_id,) in conn.execute('SELECT referral_id FROM referrals').fetchall():
+        enqueue_summary(conn.cursor(), referral_id)
+    conn.commit()
+    conn.close()
+
+    start = time.perf_counter()
+    while process_summary_jobs():
+        pass
+    sequential = time.perf_counter() - start
+    print(f"job worker {args.referrals} summaries in {sequential:.2f}s "
+          f"-> {args.referrals / sequential:.1f}/s")
+
+    reset_summaries()
+    start = time.perf_counter()
+    result = backfill_summaries(workers=args.workers, batch_size=args.workers * 4, restart=True,
+                                checkpoint_path='backfill_checkpoint.json')
+    concurrent = time.perf_counter() - start
+    print(f"backfill   {result['succeeded']} summaries in {concurrent:.2f}s "
+          f"-> {result['succeeded'] / concurrent:.1f}/s with {args.workers} workers")
@@ -0,0 +1,71 @@
+import socketserver
+import threading
+import time
+
+class _SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server session that accepts and discards every message."""
+
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        # Simulate the handshake cost of a real provider (TCP + TLS + AUTH)
+        time.sleep(self.server.connect_delay)
+        self._reply("220 localhost SMTP sink ready")
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+
+            if command.startswith(("EHLO", "HELO")):
+                self._reply("250-localhost")
+                self._reply("250-AUTH PLAIN")
+                self._reply("250 8BITMIME")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line == b".\r\n":
+                        break
+                    size += len(data_line)
+                # Simulate the provider's per-message acceptance latency
+                time.sleep(self.server.message_delay)
+                with self.server.lock:
+                    self.server.messages += 1
+                    self.server.bytes_received += size
+                self._reply("250 OK queued")
+            elif command.startswith("AUTH"):
+                self._reply("235 Authentication successful")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self._reply("250 OK")
+            else:
+                self._reply("502 Command not implemented")
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Local SMTP sink for benchmarks. Counts messages and bytes received."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, connect_delay=0.0, message_delay=0.0):
+        super().__init__((host, port), _SMTPSinkHandler)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.messages = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
@@ -0,0 +1,121 @@
+import threading
+import time
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and
+    calls are rejected immediately with CircuitOpenError. Once
+    reset_timeout seconds have passed it is half-open: a single trial call
+    is let through, closing the circuit on success or reopening it on
+    failure.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def retry_after(self):
+        """Seconds until the next call will be let through (0 if the circuit is closed)."""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0
+            return max(0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """
+        Reserve permission for a call.
+
+        Raises:
+        - CircuitOpenError: if the circuit is open, or half-open with a trial call already running
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.stats['rejected'] += 1
+            retry_after = max(0, self._opened_at + self.reset_timeout - time.monotonic())
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failures'] += 1
+            self._consecutive_failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if state != self.OPEN:
+                    self.stats['opened'] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def call(self, func, *args, **kwargs):
+        """Call func through the breaker, recording its outcome."""
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self):
+        """
+        Current breaker state for metrics.
+
+        Returns:
+        - dict: state, consecutive failures, seconds until retry and call counters
+        """
+        with self._lock:
+            state = self._current_state()
+            retry_after = max(0, self._opened_at + self.reset_timeout - time.monotonic()) if state == self.OPEN else 0
+            return {
+                'name': self.name,
+                'state': state,
+                'consecutive_failures': self._consecutive_failures,
+                'retry_after': retry_after,
+                **self.stats
+            }
@@ -0,0 +1,229 @@
+import sqlite3
+import os
+import time
+import uuid
+import zipfile
+import argparse
+from datetime import datetime, timedelta
+
+from storage_maintenance import normalize_attachment_path, UPLOADS_DIR
+
+ARCHIVE_DIR = os.path.join(UPLOADS_DIR, '_archive')
+CLOSED_STATUSES = ('Completed', 'Closed')
+
+def ensure_archive_table(conn):
+    """Create the attachment archive index if it does not exist yet."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS attachment_archive (
+        path TEXT PRIMARY KEY,
+        segment_path TEXT NOT NULL,
+        original_size INTEGER NOT NULL,
+        compressed_size INTEGER NOT NULL,
+        archived_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def _lookup_archived(path, db_path='referral_system.db'):
+    """Return the segment holding an archived attachment, or None."""
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_archive_table(conn)
+        row = conn.execute('SELECT segment_path FROM attachment_archive WHERE path = ?',
+                           (normalize_attachment_path(path),)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def open_attachment(path, db_path='referral_system.db'):
+    """
+    Open an attachment for reading, wherever it is stored.
+
+    Files still under uploads/ are opened directly. Files moved to the cold
+    tier are decompressed transparently from their archive segment.
+
+    Raises:
+    - FileNotFoundError: if the attachment is neither on disk nor archived
+    """
+    for candidate in (path, normalize_attachment_path(path)):
+        if os.path.exists(candidate):
+            return open(candidate, 'rb')
+
+    segment_path = _lookup_archived(path, db_path)
+    if segment_path is None:
+        raise FileNotFoundError(path)
+
+    # The returned member keeps the segment file open until it is closed
+    with zipfile.ZipFile(segment_path) as segment:
+        return segment.open(normalize_attachment_path(path))
+
+def attachment_size(path, db_path='referral_system.db'):
+    """
+    Size in bytes of an attachment, wherever it is stored.
+
+    Raises:
+    - FileNotFoundError: if the attachment is neither on disk nor archived
+    """
+    for candidate in (path, normalize_attachment_path(path)):
+        if os.path.exists(candidate):
+            return os.path.getsize(candidate)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_archive_table(conn)
+        row = conn.execute('SELECT original_size FROM attachment_archive WHERE path = ?',
+                           (normalize_attachment_path(path),)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise FileNotFoundError(path)
+    return row[0]
+
+def read_attachment(path, db_path='referral_system.db'):
+    """Read an attachment fully into memory, see open_attachment()."""
+    with open_attachment(path, db_path) as f:
+        return f.read()
+
+def find_cold_attachments(conn, older_than_days):
+    """Return attachment paths of closed referrals not updated for older_than_days."""
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+    placeholders = ", ".join(["?" for _ in CLOSED_STATUSES])
+
+    c = conn.cursor()
+    c.execute(f'''
+    SELECT r.attachment_paths FROM referrals r
+    WHERE r.status IN ({placeholders}) AND r.last_updated < ? AND r.attachment_paths IS NOT NULL
+    UNION ALL
+    SELECT c.attachment_paths FROM consultations c
+    JOIN referrals r ON c.referral_id = r.referral_id
+    WHERE r.status IN ({placeholders}) AND r.last_updated < ? AND c.attachment_paths IS NOT NULL
+    ''', (*CLOSED_STATUSES, cutoff, *CLOSED_STATUSES, cutoff))
+
+    paths = set()
+    for (attachment_paths,) in c.fetchall():
+        for path in attachment_paths.split(','):
+            if path.strip():
+                paths.add(normalize_attachment_path(path))
+
+    # A dry run on a database that never archived anything has no index table yet
+    has_archive = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attachment_archive'").fetchone()
+    archived = {row[0] for row in conn.execute('SELECT path FROM attachment_archive')} if has_archive else set()
+    return sorted(path for path in paths if path not in archived and os.path.exists(path))
+
+def _write_segments(paths, segment_max_bytes, compression):
+    """Write files into one or more zip segments. Returns a list of (segment_path, [members])."""
+    if not os.path.exists(ARCHIVE_DIR):
+        os.makedirs(ARCHIVE_DIR)
+
+    segments = []
+    # A random component keeps two runs in the same second from sharing segment names
+    stamp = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    current = None
+    current_bytes = 0
+
+    for path in paths:
+        size = os.path.getsize(path)
+        if current is None or current_bytes + size > segment_max_bytes:
+            if current is not None:
+                current[0].close()
+            segment_path = os.path.join(ARCHIVE_DIR, f"segment_{stamp}_{len(segments) + 1:03d}.zip")
+            # Mode 'x' never truncates an existing segment, whose originals may already be deleted
+            current = (zipfile.ZipFile(segment_path, 'x', compression=compression), segment_path, [])
+            segments.append(current)
+            current_bytes = 0
+
+        current[0].write(path, arcname=path)
+        current[2].append(path)
+        current_bytes += size
+
+    if current is not None:
+        current[0].close()
+
+    return [(segment_path, members) for _, segment_path, members in segments]
+
+def measure_read_latency(paths, db_path='referral_system.db'):
+    """Average milliseconds to read the given attachments through read_attachment()."""
+    if not paths:
+        return 0.0
+
+    start = time.perf_counter()
+    for path in paths:
+        read_attachment(path, db_path)
+    return (time.perf_counter() - start) * 1000 / len(paths)
+
+def archive_cold_attachments(older_than_days=90, segment_max_mb=256, compression=zipfile.ZIP_DEFLATED,
+                             dry_run=False, latency_sample_size=20, db_path='referral_system.db'):
+    """
+    Move attachments of closed referrals into compressed archive segments.
+
+    The archive index is committed before any original file is deleted, so an
+    interruption never leaves an attachment unreadable. A dry run only reports
+    what would be archived and writes nothing, not even the index table.
+
+    Returns:
+    - dict: files archived, bytes reclaimed and read latency before and after archiving
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        if not dry_run:
+            ensure_archive_table(conn)
+            conn.commit()
+
+        paths = find_cold_attachments(conn, older_than_days)
+        if dry_run or not paths:
+            return {'files': len(paths), 'original_bytes': sum(os.path.getsize(p) for p in paths),
+                    'reclaimed_bytes': 0, 'disk_read_ms': 0.0, 'archive_read_ms': 0.0}
+
+        sample = paths[:latency_sample_size]
+        disk_read_ms = measure_read_latency(sample, db_path)
+
+        segments = _write_segments(paths, segment_max_mb * 1024 * 1024, compression)
+
+        original_bytes = 0
+        segment_bytes = 0
+        for segment_path, members in segments:
+            with zipfile.ZipFile(segment_path) as segment:
+                # Verify CRCs before trusting the segment with the only copy
+                bad_member = segment.testzip()
+                if bad_member is not None:
+                    raise IOError(f"Archive segment {segment_path} is corrupt at {bad_member}")
+                for member in members:
+                    info = segment.getinfo(member)
+                    conn.execute('''
+                    INSERT INTO attachment_archive (path, segment_path, original_size, compressed_size)
+                    VALUES (?, ?, ?, ?)
+                    ''', (member, segment_path, info.file_size, info.compress_size))
+                    original_bytes += info.file_size
+            segment_bytes += os.path.getsize(segment_path)
+        conn.commit()
+
+        for segment_path, members in segments:
+            for member in members:
+                os.remove(member)
+
+        return {
+            'files': len(paths),
+            'original_bytes': original_bytes,
+            'reclaimed_bytes': original_bytes - segment_bytes,
+            'disk_read_ms': disk_read_ms,
+            'archive_read_ms': measure_read_latency(sample, db_path)
+        }
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move attachments of old closed referrals to compressed archives.")
+    parser.add_argument("--older-than-days", type=int, default=90, help="Only archive referrals idle for this long")
+    parser.add_argument("--segment-max-mb", type=int, default=256, help="Maximum uncompressed size per segment")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived")
+    args = parser.parse_args()
+
+    result = archive_cold_attachments(args.older_than_days, args.segment_max_mb, dry_run=args.dry_run)
+
+    if args.dry_run:
+        print(f"{result['files']} attachments ({result['original_bytes'] / 1024 / 1024:.2f} MB) would be archived")
+    else:
+        print(f"Archived {result['files']} attachments ({result['original_bytes'] / 1024 / 1024:.2f} MB)")
+        print(f"Disk space reclaimed: {result['reclaimed_bytes'] / 1024 / 1024:.2f} MB")
+        print(f"Average read latency: {result['disk_read_ms']:.2f} ms on disk, "
+              f"{result['archive_read_ms']:.2f} ms archived "
+              f"(+{result['archive_read_ms'] - result['disk_read_ms']:.2f} ms)")
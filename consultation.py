@@ -1,7 +1,8 @@
 import sqlite3
 import os
 from referral import save_uploaded_file
-from email_service import send_consultation_notification
+from image_processing import queue_attachment_normalization
+from notification_outbox import enqueue_notification
 
 def submit_consultation(referral_id, doctor_id, assessment, recommendation, additional_info_needed, 
                        uploaded_files, status, diagnosis=None, treatment_plan=None, medications=None,
@@ -17,9 +18,15 @@ def submit_consultation(referral_id, doctor_id, assessment, recommendation, addi
             file_path = save_uploaded_file(file, doctor_id, f"{referral_id}_consultation")
             file_paths.append(file_path)
     
-    # Get old status of the referral
-    c.execute('SELECT status FROM referrals WHERE referral_id = ?', (referral_id,))
-    old_status = c.fetchone()[0]
+    # Get the old status of the referral and what the notification needs in one query
+    c.execute('''
+    SELECT r.status, r.patient_name, ref_doc.email, ref_doc.full_name, cons_doc.full_name
+    FROM referrals r
+    JOIN users ref_doc ON r.referring_doctor_id = ref_doc.id
+    LEFT JOIN users cons_doc ON cons_doc.id = ?
+    WHERE r.referral_id = ?
+    ''', (doctor_id, referral_id))
+    old_status, patient_name, referring_doctor_email, referring_doctor_name, consulting_doctor_name = c.fetchone()
     
     # Insert consultation into database with enhanced fields
     c.execute('''
@@ -53,19 +60,21 @@ def submit_consultation(referral_id, doctor_id, assessment, recommendation, addi
     VALUES (?, ?, ?, ?)
     ''', (referral_id, old_status, status, doctor_id))
     
-    # Get the referring doctor's email to send notification
-    c.execute('''
-    SELECT u.email FROM referrals r
-    JOIN users u ON r.referring_doctor_id = u.id
-    WHERE r.referral_id = ?
-    ''', (referral_id,))
-    
-    referring_doctor_email = c.fetchone()[0]
+    # Queue the email notification to the referring doctor with the consultation, with everything
+    # the email needs so delivery does not read the consultation back
+    enqueue_notification(c, 'consultation', referring_doctor_email, {
+        'referral_id': referral_id,
+        'status': status,
+        'patient_name': patient_name,
+        'referring_doctor': referring_doctor_name,
+        'consulting_doctor': consulting_doctor_name,
+        'additional_information_needed': additional_info_needed
+    })
     
     conn.commit()
     conn.close()
     
-    # Send email notification to referring doctor
-    send_consultation_notification(referring_doctor_email, referral_id, status)
+    # Re-encode image attachments in the background now that their paths are stored
+    queue_attachment_normalization(file_paths)
     
     return True
\ No newline at end of file
@@ -1,5 +1,34 @@
 import sqlite3
 
+# Returned in place of a summary when the API call fails
+SUMMARY_UNAVAILABLE = "AI summary unavailable due to a processing error."
+
+# Referrals still missing a summary. The partial index idx_referrals_missing_summary and the backfill
+# queries both use this predicate, built from SUMMARY_UNAVAILABLE so the two never drift apart
+MISSING_SUMMARY_SQL = "(gpt_summary IS NULL OR gpt_summary = '{}')".format(SUMMARY_UNAVAILABLE.replace("'", "''"))
+MISSING_SUMMARY_INDEX_SQL = f"CREATE INDEX idx_referrals_missing_summary ON referrals (id) WHERE {MISSING_SUMMARY_SQL}"
+
+def ensure_missing_summary_index(cursor):
+    """
+    Create the partial index of referrals missing a summary, rebuilding it if
+    it was created with a different predicate.
+
+    CREATE INDEX IF NOT EXISTS keeps an index whose WHERE clause no longer
+    matches MISSING_SUMMARY_SQL, and SQLite then stops using it for the
+    backfill queries, so the stored definition is compared first.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): Cursor on the referral database
+    """
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'idx_referrals_missing_summary'")
+    row = cursor.fetchone()
+    if row and ' '.join(row[0].split()) == ' '.join(MISSING_SUMMARY_INDEX_SQL.split()):
+        return
+    if row:
+        print("Rebuilding idx_referrals_missing_summary for the current summary predicate")
+        cursor.execute("DROP INDEX idx_referrals_missing_summary")
+    cursor.execute(MISSING_SUMMARY_INDEX_SQL)
+
 def init_db():
     """Initialize the SQLite database with enhanced tables for comprehensive referral system."""
     conn = sqlite3.connect('referral_system.db')
@@ -45,6 +74,8 @@ def init_db():
         attachment_paths TEXT,
         additional_details TEXT,
         gpt_summary TEXT,  -- ✅ New column for AI-generated summary
+        gpt_summary_status TEXT,  -- pending, ready or failed while the background job runs
+        gpt_summary_hash TEXT,  -- hash of the inputs the stored summary was generated from
         status TEXT DEFAULT 'Pending',
         priority INTEGER DEFAULT 0,
         creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -106,5 +137,102 @@ def init_db():
     )
     ''')
 
+    # Index of attachments moved to compressed cold storage segments
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS attachment_archive (
+        path TEXT PRIMARY KEY,
+        segment_path TEXT NOT NULL,
+        original_size INTEGER NOT NULL,
+        compressed_size INTEGER NOT NULL,
+        archived_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+    # Outbox of email notifications, written in the same transaction as the referral
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        recipient TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        claimed_at TIMESTAMP,
+        next_attempt_at TIMESTAMP,
+        sent_at TIMESTAMP
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox (status, id)')
+
+    # Queue of AI summaries to generate after the referral is committed
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS summary_jobs (
+        id INTEGER PRIMARY KEY,
+        referral_id TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        claimed_at TIMESTAMP,
+        next_attempt_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        FOREIGN KEY (referral_id) REFERENCES referrals (referral_id)
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_summary_jobs_status ON summary_jobs (status, id)')
+
+    # Databases created before the background summary job lack its columns; add them at start-up
+    # so create_referral() keeps queueing summaries without running migrate_database.py first
+    c.execute("PRAGMA table_info(referrals)")
+    referral_columns = [info[1] for info in c.fetchall()]
+    for column_name in ('gpt_summary', 'gpt_summary_status', 'gpt_summary_hash'):
+        if column_name not in referral_columns:
+            c.execute(f"ALTER TABLE referrals ADD COLUMN {column_name} TEXT")
+
+    # Partial index of referrals still missing an AI summary, used by backfill_summaries.py
+    ensure_missing_summary_index(c)
+
+    # Persistent cache of LLM responses keyed on a hash of the request
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed)')
+
+    # Prompt and completion tokens of every LLM call
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS llm_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        purpose TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        cached INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_llm_usage_created_at ON llm_usage (created_at)')
+
+    # OpenFDA medication search results keyed on the normalized query
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS openfda_cache (
+        endpoint TEXT NOT NULL,
+        query TEXT NOT NULL,
+        results TEXT NOT NULL,
+        hits INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (endpoint, query)
+    )
+    ''')
+
     conn.commit()
     conn.close()
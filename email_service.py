@@ -1,12 +1,15 @@
 import sqlite3
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-import streamlit as st
+import html
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+import threading
+from smtp_pool import SMTPConnectionPool
+from rate_limit import get_rate_limiter
+from mime_stream import plan_attachments, linked_attachments_note, iter_message
+from email_templates import (render_template, render_fragment, SafeHTML, ADDITIONAL_INFORMATION,
+                             DIGEST_ROW, urgency_class, status_class)
 
 # Load environment variables
 load_dotenv()
@@ -16,15 +19,51 @@ EMAIL_SERVER = os.getenv("EMAIL_SERVER", "smtp.gmail.com")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
 EMAIL_USERNAME = os.getenv("EMAIL_USERNAME", "")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() in ("1", "true", "yes")
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", 4))
+# Provider send rate; keeps bursts under the SMTP provider's limits
+EMAIL_RATE_LIMIT_PER_SECOND = float(os.getenv("EMAIL_RATE_LIMIT_PER_SECOND", 5))
+EMAIL_RATE_LIMIT_BURST = int(os.getenv("EMAIL_RATE_LIMIT_BURST", 10))
 
-def send_email(recipient_email, subject, message, html_message=None, attachments=None):
-    """Send an actual email using SMTP with optional HTML content."""
+_smtp_pool = None
+_smtp_pool_lock = threading.Lock()
+_preview_sink = None
+
+def get_smtp_pool():
+    """Return the process-wide pool of authenticated SMTP sessions."""
+    global _smtp_pool
+    with _smtp_pool_lock:
+        if _smtp_pool is None:
+            _smtp_pool = SMTPConnectionPool(EMAIL_SERVER, EMAIL_PORT, EMAIL_USERNAME, EMAIL_PASSWORD,
+                                            use_tls=EMAIL_USE_TLS, max_size=EMAIL_POOL_SIZE)
+        return _smtp_pool
+
+def send_email(recipient_email, subject, message, html_message=None, attachments=None, raise_errors=False):
+    """
+    Send an actual email using SMTP with optional HTML content.
+
+    Attachments up to EMAIL_ATTACHMENT_MAX_BYTES are base64-encoded while
+    the message is sent, so they are never held in memory in full; larger
+    ones are listed in the message body for download instead.
+
+    Returns True on success. On failure returns False, or re-raises the
+    exception when raise_errors is set so callers (e.g. the outbox worker)
+    can decide whether to retry.
+    """
     try:
+        attached, linked = plan_attachments(attachments) if attachments else ([], [])
+        if linked:
+            note = linked_attachments_note(linked)
+            message += note
+            if html_message:
+                note_html = f"<pre>{html.escape(note.strip())}</pre>"
+                if "</body>" in html_message:
+                    html_message = html_message.replace("</body>", note_html + "</body>", 1)
+                else:
+                    html_message += note_html
+
         # Create message container
         msg = MIMEMultipart('alternative')
-        msg['From'] = EMAIL_USERNAME
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
         
         # Attach plain text message
         msg.attach(MIMEText(message, 'plain'))
@@ -33,157 +72,119 @@ def send_email(recipient_email, subject, message, html_message=None, attachments
         if html_message:
             msg.attach(MIMEText(html_message, 'html'))
         
-        # Attach files if provided
-        if attachments:
-            for attachment in attachments:
-                with open(attachment, 'rb') as file:
-                    part = MIMEApplication(file.read(), Name=os.path.basename(attachment))
-                    part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment)}"'
-                    msg.attach(part)
+        headers = {'From': EMAIL_USERNAME, 'To': recipient_email, 'Subject': subject}
         
-        # Connect to server and send email
-        server = smtplib.SMTP(EMAIL_SERVER, EMAIL_PORT)
-        server.starttls()  # Secure the connection
-        server.login(EMAIL_USERNAME, EMAIL_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        # Respect the provider's rate limit, then send over a pooled session
+        get_rate_limiter(EMAIL_SERVER, EMAIL_RATE_LIMIT_PER_SECOND, EMAIL_RATE_LIMIT_BURST).acquire()
+        if attached:
+            paths = [path for path, _ in attached]
+            get_smtp_pool().send_chunks(EMAIL_USERNAME, [recipient_email],
+                                        lambda: iter_message(headers, msg, paths))
+        else:
+            for name, value in headers.items():
+                msg[name] = value
+            get_smtp_pool().send_message(msg)
         
         print(f"Email sent to {recipient_email}")
         return True
     
     except Exception as e:
         print(f"Failed to send email: {e}")
-        # Store in session state for UI display (fallback)
-        if 'last_email' not in st.session_state:
-            st.session_state.last_email = {}
-        
-        st.session_state.last_email = {
-            'to': recipient_email,
-            'subject': subject,
-            'message': message,
-            'error': str(e)
-        }
+        if raise_errors:
+            raise
         return False
 
+def set_preview_sink(sink):
+    """
+    Register a callable that receives a preview dict for every notification sent.
+
+    The email service itself has no UI; a front end that wants to show what
+    was sent (e.g. Streamlit) installs a sink. Pass None to remove it.
+    """
+    global _preview_sink
+    _preview_sink = sink
+
+def _publish_preview(result, preview_sink=None):
+    """Hand a notification result to the per-call sink, or the registered one."""
+    sink = preview_sink or _preview_sink
+    if sink is None:
+        return
+    try:
+        sink(result)
+    except Exception as e:
+        print(f"Email preview sink failed: {e}")
+
+def _send_notification(recipient_email, notification, raise_errors=False, preview_sink=None):
+    """
+    Send a built notification and publish its preview.
+
+    Returns:
+    - dict: to, subject, message, success and error (None on success)
+    """
+    result = {
+        'to': recipient_email,
+        'subject': notification['subject'],
+        'message': notification['message'],
+        'success': False,
+        'error': None
+    }
+    try:
+        result['success'] = send_email(recipient_email, notification['subject'], notification['message'],
+                                       notification['html'], raise_errors=True)
+    except Exception as e:
+        result['error'] = str(e)
+        _publish_preview(result, preview_sink)
+        if raise_errors:
+            raise
+        return result
+
+    _publish_preview(result, preview_sink)
+    return result
+
 def get_referral_email_template(referral, referral_id):
     """Get HTML email template for referral notification."""
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background-color: #006E3B; color: white; padding: 10px 20px; }}
-            .content {{ padding: 20px; background-color: #f9f9f9; }}
-            .footer {{ font-size: 12px; color: #777; padding: 10px 20px; text-align: center; }}
-            table {{ width: 100%; border-collapse: collapse; }}
-            th, td {{ padding: 8px; text-align: left; border-bottom: 1px solid #ddd; }}
-            th {{ background-color: #f2f2f2; }}
-            .priority-high {{ color: #D32F2F; font-weight: bold; }}
-            .priority-medium {{ color: #F57C00; font-weight: bold; }}
-            .priority-normal {{ color: #388E3C; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h2>Medical Referral Notification</h2>
-            </div>
-            <div class="content">
-                <p>Dear Doctor,</p>
-                
-                <p>You have received a new patient referral from Dr. {referral['referring_doctor']}.</p>
-                
-                <table>
-                    <tr>
-                        <th>Referral ID</th>
-                        <td>{referral_id}</td>
-                    </tr>
-                    <tr>
-                        <th>Patient Name</th>
-                        <td>{referral['patient_name']}</td>
-                    </tr>
-                    <tr>
-                        <th>Urgency</th>
-                        <td class="priority-{'high' if referral['urgency'] == 'Emergency' else 'medium' if referral['urgency'] == 'Urgent' else 'normal'}">{referral['urgency']}</td>
-                    </tr>
-                </table>
-                
-                <p>Please log in to the Doctor Referral System to view complete patient information and provide your consultation.</p>
-                
-                <p>Reason for Referral:</p>
-                <p>{referral['reason_for_referral']}</p>
-            </div>
-            <div class="footer">
-                <p>This is an automated message. Please do not reply to this email.</p>
-                <p>© {datetime.now().year} Doctor Referral System</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+    return render_template('referral', {
+        'referring_doctor': referral['referring_doctor'],
+        'referral_id': referral_id,
+        'patient_name': referral['patient_name'],
+        'priority_class': urgency_class(referral['urgency']),
+        'urgency': referral['urgency'],
+        'reason_for_referral': referral['reason_for_referral']
+    })
 
 def get_consultation_email_template(consultation, referral_id, status, referring_doctor):
     """Get HTML email template for consultation notification."""
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-            .header {{ background-color: #006E3B; color: white; padding: 10px 20px; }}
-            .content {{ padding: 20px; background-color: #f9f9f9; }}
-            .footer {{ font-size: 12px; color: #777; padding: 10px 20px; text-align: center; }}
-            table {{ width: 100%; border-collapse: collapse; }}
-            th, td {{ padding: 8px; text-align: left; border-bottom: 1px solid #ddd; }}
-            th {{ background-color: #f2f2f2; }}
-            .status-completed {{ color: #388E3C; font-weight: bold; }}
-            .status-inprogress {{ color: #2196F3; font-weight: bold; }}
-            .status-additional {{ color: #9C27B0; font-weight: bold; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h2>Consultation Response</h2>
-            </div>
-            <div class="content">
-                <p>Dear Dr. {referring_doctor},</p>
-                
-                <p>A consultation response has been submitted by Dr. {consultation['consulting_doctor']} for your referral.</p>
-                
-                <table>
-                    <tr>
-                        <th>Referral ID</th>
-                        <td>{referral_id}</td>
-                    </tr>
-                    <tr>
-                        <th>Patient Name</th>
-                        <td>{consultation['patient_name']}</td>
-                    </tr>
-                    <tr>
-                        <th>Status</th>
-                        <td class="status-{'completed' if status == 'Completed' else 'inprogress' if status == 'In Progress' else 'additional'}">{status}</td>
-                    </tr>
-                </table>
-                
-                {f"<p><strong>Additional Information Needed:</strong></p><p>{consultation.get('additional_information_needed', '')}</p>" if status == 'Requires Additional Information' else ""}
-                
-                <p>Please log in to the Doctor Referral System to view the complete consultation details.</p>
-            </div>
-            <div class="footer">
-                <p>This is an automated message. Please do not reply to this email.</p>
-                <p>© {datetime.now().year} Doctor Referral System</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+    additional_information = ''
+    if status == 'Requires Additional Information':
+        additional_information = render_fragment(ADDITIONAL_INFORMATION,
+                                                 {'text': consultation.get('additional_information_needed', '')})
+    
+    return render_template('consultation', {
+        'referring_doctor': referring_doctor,
+        'consulting_doctor': consultation['consulting_doctor'],
+        'referral_id': referral_id,
+        'patient_name': consultation['patient_name'],
+        'status_class': status_class(status),
+        'status': status,
+        'additional_information': SafeHTML(additional_information)
+    })
+
+def get_referral_digest_email_template(referrals):
+    """Get HTML email template for a digest of several referrals."""
+    rows = "".join(
+        render_fragment(DIGEST_ROW, {
+            'patient_name': r['patient_name'],
+            'priority_class': urgency_class(r['urgency']),
+            'urgency': r['urgency'],
+            'referring_doctor': r['referring_doctor'],
+            'reason_for_referral': r['reason_for_referral']
+        })
+        for r in referrals
+    )
+    return render_template('referral_digest', {'count': len(referrals), 'rows': SafeHTML(rows)})
 
-def send_referral_notification(recipient_email, referral_id):
-    """Send an email notification for a new referral."""
+def build_referral_notification(referral_id):
+    """Build subject, plain text and HTML for a new referral notification, loading the referral by id."""
     # Get referral details for personalized email
     conn = sqlite3.connect('referral_system.db')
     conn.row_factory = sqlite3.Row
@@ -199,6 +200,17 @@ def send_referral_notification(recipient_email, referral_id):
     referral = dict(c.fetchone())
     conn.close()
     
+    return render_referral_notification(referral)
+
+def render_referral_notification(referral):
+    """
+    Build subject, plain text and HTML for a new referral notification from data already in hand.
+
+    Parameters:
+    - referral (dict): referral_id, referring_doctor, patient_name, urgency and reason_for_referral
+    """
+    referral_id = referral['referral_id']
+
     # Create a more informative email message
     message = f"""
 Dear Doctor,
@@ -214,27 +226,103 @@ Please log in to the system to view the complete details and provide your consul
 This is an automated message. Please do not reply to this email.
     """
     
-    subject = f"New Medical Referral - {referral['urgency']} - {referral['patient_name']}"
+    return {
+        'subject': f"New Medical Referral - {referral['urgency']} - {referral['patient_name']}",
+        'message': message,
+        'html': get_referral_email_template(referral, referral_id)
+    }
+
+def send_referral_notification(recipient_email, referral_id, raise_errors=False, preview_sink=None, referral=None):
+    """
+    Send an email notification for a new referral. Returns a notification result dict.
+
+    Pass the prepared referral dict (see render_referral_notification()) to
+    skip reading the referral back from the database.
+    """
+    notification = (render_referral_notification(referral) if referral is not None
+                    else build_referral_notification(referral_id))
+    return _send_notification(recipient_email, notification, raise_errors, preview_sink)
+
+def publish_referral_preview(recipient_email, referral, preview_sink=None):
+    """
+    Publish a preview of a queued referral notification without sending it.
+
+    The outbox worker sends the email later and has no UI, so the caller
+    that created the referral previews it from the same payload. Nothing is
+    rendered when no sink is set.
+
+    Returns:
+    - dict: to, subject, message and queued (True), or None without a sink
+    """
+    if (preview_sink or _preview_sink) is None:
+        return None
+    notification = render_referral_notification(referral)
+    result = {
+        'to': recipient_email,
+        'subject': notification['subject'],
+        'message': notification['message'],
+        'queued': True
+    }
+    _publish_preview(result, preview_sink)
+    return result
+
+def build_referral_digest(referral_ids):
+    """Build subject, plain text and HTML for a digest of several new referrals."""
+    conn = sqlite3.connect('referral_system.db')
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
     
-    # Get HTML template
-    html_message = get_referral_email_template(referral, referral_id)
+    placeholders = ", ".join(["?" for _ in referral_ids])
+    c.execute(f'''
+    SELECT r.referral_id, r.patient_name, r.urgency, r.reason_for_referral, u.full_name as referring_doctor
+    FROM referrals r
+    JOIN users u ON r.referring_doctor_id = u.id
+    WHERE r.referral_id IN ({placeholders})
+    ORDER BY r.creation_date
+    ''', list(referral_ids))
     
-    # Send the actual email
-    success = send_email(recipient_email, subject, message, html_message)
+    referrals = [dict(row) for row in c.fetchall()]
+    conn.close()
     
-    # Store in session state for UI preview (even if email sending fails)
-    if 'last_email' not in st.session_state:
-        st.session_state.last_email = {}
+    return render_referral_digest(referrals)
+
+def render_referral_digest(referrals):
+    """Build subject, plain text and HTML for a digest from a list of prepared referral dicts."""
+    lines = [
+        f"- {r['patient_name']} ({r['urgency']}) from Dr. {r['referring_doctor']}: {r['reason_for_referral']} [ID: {r['referral_id']}]"
+        for r in referrals
+    ]
+    message = f"""
+Dear Doctor,
+
+You have received {len(referrals)} new referrals:
+
+{chr(10).join(lines)}
+
+Please log in to the system to view the complete details and provide your consultations.
+
+This is an automated message. Please do not reply to this email.
+    """
     
-    st.session_state.last_email = {
-        'to': recipient_email,
-        'subject': subject,
+    return {
+        'subject': f"{len(referrals)} New Medical Referrals",
         'message': message,
-        'success': success
+        'html': get_referral_digest_email_template(referrals)
     }
 
-def send_consultation_notification(recipient_email, referral_id, status):
-    """Send an email notification for a consultation response."""
+def send_referral_digest(recipient_email, referral_ids, raise_errors=False, preview_sink=None, referrals=None):
+    """
+    Send one summary email covering several new referrals for the same recipient.
+
+    Pass the prepared referral dicts to skip reading them back from the
+    database. Returns a notification result dict.
+    """
+    notification = (render_referral_digest(referrals) if referrals is not None
+                    else build_referral_digest(referral_ids))
+    return _send_notification(recipient_email, notification, raise_errors, preview_sink)
+
+def build_consultation_notification(referral_id, status):
+    """Build subject, plain text and HTML for a consultation response notification, loading it by referral id."""
     # Get consultation details for personalized email
     conn = sqlite3.connect('referral_system.db')
     conn.row_factory = sqlite3.Row
@@ -258,9 +346,24 @@ def send_consultation_notification(recipient_email, referral_id, status):
     WHERE r.referral_id = ?
     ''', (referral_id,))
     
-    referring_doctor = c.fetchone()[0]
+    consultation['referring_doctor'] = c.fetchone()[0]
+    consultation['referral_id'] = referral_id
     conn.close()
     
+    return render_consultation_notification(consultation, status)
+
+def render_consultation_notification(consultation, status):
+    """
+    Build subject, plain text and HTML for a consultation response from data already in hand.
+
+    Parameters:
+    - consultation (dict): referral_id, referring_doctor, consulting_doctor, patient_name
+      and additional_information_needed
+    - status (str): The consultation status
+    """
+    referral_id = consultation['referral_id']
+    referring_doctor = consultation['referring_doctor']
+
     # Create a more informative email message
     message = f"""
 Dear Dr. {referring_doctor},
@@ -277,106 +380,20 @@ Please log in to the system to view the complete consultation details.
 This is an automated message. Please do not reply to this email.
     """
     
-    subject = f"Consultation Response - {status} - Referral ID: {referral_id}"
-    
-    # Get HTML template
-    html_message = get_consultation_email_template(consultation, referral_id, status, referring_doctor)
-    
-    # Send the actual email
-    success = send_email(recipient_email, subject, message, html_message)
-    
-    # Store in session state for UI preview
-    if 'last_email' not in st.session_state:
-        st.session_state.last_email = {}
-    
-    st.session_state.last_email = {
-        'to': recipient_email,
-        'subject': subject,
+    return {
+        'subject': f"Consultation Response - {status} - Referral ID: {referral_id}",
         'message': message,
-        'success': success
+        'html': get_consultation_email_template(consultation, referral_id, status, referring_doctor)
     }
 
-def render_email_settings():
-    """Render the email settings page."""
-    st.header("Email Server Configuration")
-    
-    # Display current settings
-    st.subheader("Current Email Settings")
-    st.write(f"**SMTP Server:** {os.getenv('EMAIL_SERVER', 'Not configured')}")
-    st.write(f"**SMTP Port:** {os.getenv('EMAIL_PORT', 'Not configured')}")
-    st.write(f"**Email Username:** {os.getenv('EMAIL_USERNAME', 'Not configured')}")
-    
-    # Form to update settings
-    st.subheader("Update Email Settings")
-    with st.form("email_settings_form"):
-        server = st.text_input("SMTP Server", value=os.getenv("EMAIL_SERVER", ""))
-        port = st.number_input("SMTP Port", min_value=1, max_value=65535, value=int(os.getenv("EMAIL_PORT", 587)))
-        username = st.text_input("Email Username", value=os.getenv("EMAIL_USERNAME", ""))
-        password = st.text_input("Email Password", type="password")
-        
-        submit = st.form_submit_button("Save Settings")
-        
-        if submit:
-            # Update .env file
-            with open(".env", "w") as f:
-                f.write(f"EMAIL_SERVER={server}\n")
-                f.write(f"EMAIL_PORT={port}\n")
-                f.write(f"EMAIL_USERNAME={username}\n")
-                if password:
-                    f.write(f"EMAIL_PASSWORD={password}\n")
-                else:
-                    f.write(f"EMAIL_PASSWORD={os.getenv('EMAIL_PASSWORD', '')}\n")
-            
-            st.success("Email settings updated successfully! Please restart the application for changes to take effect.")
+def send_consultation_notification(recipient_email, referral_id, status, raise_errors=False, preview_sink=None,
+                                   consultation=None):
+    """
+    Send an email notification for a consultation response. Returns a notification result dict.
 
-def render_email_test():
-    """Render a page to test email sending."""
-    st.header("Test Email Configuration")
-    
-    with st.form("test_email_form"):
-        recipient = st.text_input("Recipient Email")
-        subject = st.text_input("Subject", value="Test Email from Doctor Referral System")
-        message = st.text_area("Message", value="This is a test email to verify the email server configuration.")
-        
-        submit = st.form_submit_button("Send Test Email")
-        
-        if submit:
-            if recipient:
-                # Create HTML version of the message
-                html_message = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <style>
-                        body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                        .header {{ background-color: #006E3B; color: white; padding: 10px 20px; }}
-                        .content {{ padding: 20px; background-color: #f9f9f9; }}
-                        .footer {{ font-size: 12px; color: #777; padding: 10px 20px; text-align: center; }}
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <div class="header">
-                            <h2>Test Email</h2>
-                        </div>
-                        <div class="content">
-                            <p>{message}</p>
-                            <p>If you're seeing this email, your email configuration is working correctly!</p>
-                        </div>
-                        <div class="footer">
-                            <p>This is an automated message from the Doctor Referral System.</p>
-                            <p>© {datetime.now().year} Doctor Referral System</p>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                
-                success = send_email(recipient, subject, message, html_message)
-                if success:
-                    st.success(f"Test email sent successfully to {recipient}")
-                else:
-                    st.error("Failed to send test email. Check server logs for details.")
-            else:
-                st.warning("Please enter a recipient email address")
\ No newline at end of file
+    Pass the prepared consultation dict (see render_consultation_notification())
+    to skip reading it back from the database.
+    """
+    notification = (render_consultation_notification(consultation, status) if consultation is not None
+                    else build_consultation_notification(referral_id, status))
+    return _send_notification(recipient_email, notification, raise_errors, preview_sink)
@@ -0,0 +1,170 @@
+import html
+from string import Template
+from datetime import datetime
+
+# Shared styling for every notification email
+BASE_CSS = """
+            body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+            .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+            .header { background-color: #006E3B; color: white; padding: 10px 20px; }
+            .content { padding: 20px; background-color: #f9f9f9; }
+            .footer { font-size: 12px; color: #777; padding: 10px 20px; text-align: center; }
+            table { width: 100%; border-collapse: collapse; }
+            th, td { padding: 8px; text-align: left; border-bottom: 1px solid #ddd; }
+            th { background-color: #f2f2f2; }
+            .priority-high { color: #D32F2F; font-weight: bold; }
+            .priority-medium { color: #F57C00; font-weight: bold; }
+            .priority-normal { color: #388E3C; }
+            .status-completed { color: #388E3C; font-weight: bold; }
+            .status-inprogress { color: #2196F3; font-weight: bold; }
+            .status-additional { color: #9C27B0; font-weight: bold; }"""
+
+_LAYOUT = Template("""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <style>$css
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h2>$title</h2>
+            </div>
+            <div class="content">$body
+            </div>
+            <div class="footer">
+                <p>$footer</p>
+                <p>© $${year} Doctor Referral System</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+class SafeHTML(str):
+    """A string that is already valid HTML and must not be escaped when rendered."""
+
+class EmailTemplate:
+    """
+    An HTML email template parsed once at registration.
+
+    The shared layout and CSS are merged into the template up front, so
+    rendering is a single substitution of escaped context values.
+    """
+
+    def __init__(self, title, body, footer="This is an automated message. Please do not reply to this email."):
+        # $${year} in the layout survives this first pass as a render-time ${year}
+        self._template = Template(_LAYOUT.substitute(css=BASE_CSS, title=html.escape(title),
+                                                     body=body, footer=html.escape(footer)))
+
+    def render(self, context):
+        """Render the template, HTML-escaping every value that is not SafeHTML."""
+        values = {'year': datetime.now().year}
+        for key, value in context.items():
+            values[key] = value if isinstance(value, SafeHTML) else html.escape('' if value is None else str(value))
+        return self._template.substitute(values)
+
+_registry = {}
+
+def register_template(name, template):
+    """Add a template to the registry under name."""
+    _registry[name] = template
+    return template
+
+def render_template(name, context):
+    """Render a registered template with a context dict."""
+    return _registry[name].render(context)
+
+def render_fragment(template, context):
+    """Render a small Template (e.g. a table row) with escaped values, returning SafeHTML."""
+    return SafeHTML(template.substitute({key: html.escape('' if value is None else str(value))
+                                         for key, value in context.items()}))
+
+register_template('referral', EmailTemplate("Medical Referral Notification", """
+                <p>Dear Doctor,</p>
+
+                <p>You have received a new patient referral from Dr. ${referring_doctor}.</p>
+
+                <table>
+                    <tr>
+                        <th>Referral ID</th>
+                        <td>${referral_id}</td>
+                    </tr>
+                    <tr>
+                        <th>Patient Name</th>
+                        <td>${patient_name}</td>
+                    </tr>
+                    <tr>
+                        <th>Urgency</th>
+                        <td class="priority-${priority_class}">${urgency}</td>
+                    </tr>
+                </table>
+
+                <p>Please log in to the Doctor Referral System to view complete patient information and provide your consultation.</p>
+
+                <p>Reason for Referral:</p>
+                <p>${reason_for_referral}</p>"""))
+
+register_template('consultation', EmailTemplate("Consultation Response", """
+                <p>Dear Dr. ${referring_doctor},</p>
+
+                <p>A consultation response has been submitted by Dr. ${consulting_doctor} for your referral.</p>
+
+                <table>
+                    <tr>
+                        <th>Referral ID</th>
+                        <td>${referral_id}</td>
+                    </tr>
+                    <tr>
+                        <th>Patient Name</th>
+                        <td>${patient_name}</td>
+                    </tr>
+                    <tr>
+                        <th>Status</th>
+                        <td class="status-${status_class}">${status}</td>
+                    </tr>
+                </table>
+
+                ${additional_information}
+
+                <p>Please log in to the Doctor Referral System to view the complete consultation details.</p>"""))
+
+register_template('referral_digest', EmailTemplate("Medical Referral Digest", """
+                <p>Dear Doctor,</p>
+
+                <p>You have received ${count} new patient referrals.</p>
+
+                <table>
+                    <tr>
+                        <th>Patient Name</th>
+                        <th>Urgency</th>
+                        <th>From</th>
+                        <th>Reason</th>
+                    </tr>${rows}
+                </table>
+
+                <p>Please log in to the Doctor Referral System to view complete patient information and provide your consultations.</p>"""))
+
+register_template('test', EmailTemplate("Test Email", """
+                <p>${message}</p>
+                <p>If you're seeing this email, your email configuration is working correctly!</p>""",
+                footer="This is an automated message from the Doctor Referral System."))
+
+DIGEST_ROW = Template("""
+                    <tr>
+                        <td>${patient_name}</td>
+                        <td class="priority-${priority_class}">${urgency}</td>
+                        <td>Dr. ${referring_doctor}</td>
+                        <td>${reason_for_referral}</td>
+                    </tr>""")
+
+ADDITIONAL_INFORMATION = Template("<p><strong>Additional Information Needed:</strong></p><p>${text}</p>")
+
+def urgency_class(urgency):
+    """CSS class suffix for a referral urgency."""
+    return 'high' if urgency == 'Emergency' else 'medium' if urgency == 'Urgent' else 'normal'
+
+def status_class(status):
+    """CSS class suffix for a consultation status."""
+    return 'completed' if status == 'Completed' else 'inprogress' if status == 'In Progress' else 'additional'
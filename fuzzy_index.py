@@ -0,0 +1,127 @@
+from collections import Counter
+
+# Candidates sharing the most trigrams with the query are verified with the edit distance, at most this many
+MAX_CANDIDATES = 64
+MIN_FUZZY_LENGTH = 4  # shorter queries are too ambiguous to correct
+
+def default_max_distance(query):
+    """Typos tolerated for a query: one for short words, two from six characters."""
+    return 1 if len(query) <= 5 else 2
+
+def trigrams(text):
+    """
+    Trigrams of text padded at the start only, e.g. "met" -> $$m, $me, met.
+
+    Without end padding a prefix of a word shares all its trigrams with
+    the word, so partially typed names still match.
+    """
+    padded = "$$" + text
+    return [padded[i:i + 3] for i in range(len(text))]
+
+def edit_distance(a, b, max_distance, prefix=False):
+    """
+    Optimal string alignment distance between a and b (insertions, deletions,
+    substitutions and adjacent transpositions), capped at max_distance + 1.
+
+    Only the diagonal band of width max_distance is computed, and the
+    computation stops as soon as the distance must exceed max_distance.
+    With prefix set, the distance to the closest prefix of b is returned.
+    """
+    too_far = max_distance + 1
+    if prefix:
+        b = b[:len(a) + max_distance]
+    elif abs(len(a) - len(b)) > max_distance:
+        return too_far
+
+    before = None
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [i if i <= max_distance else too_far] + [too_far] * len(b)
+        best = current[0]
+        char = a[i - 1]
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            other = b[j - 1]
+            value = previous[j - 1] + (char != other)
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == other and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < best:
+                best = value
+        if best > max_distance:
+            return too_far
+        before, previous = previous, current
+    return min(min(previous) if prefix else previous[-1], too_far)
+
+class TrigramIndex:
+    """
+    Typo-tolerant lookup of terms.
+
+    Each term is listed under its trigrams. A lookup counts the trigrams
+    every term shares with the query (one edit changes at most four), and
+    only terms sharing enough of them are checked with the edit distance,
+    so the cost depends on how common the query's trigrams are rather than
+    on the number of terms. Terms can be added at any time.
+    """
+
+    def __init__(self, terms=()):
+        self.terms = []
+        self._ids = {}
+        self._grams = {}
+        for term in terms:
+            self.add(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def add(self, term):
+        """Index a term (once) and return its id."""
+        if term in self._ids:
+            return self._ids[term]
+        term_id = self._ids[term] = len(self.terms)
+        self.terms.append(term)
+        for gram in set(trigrams(term)):
+            self._grams.setdefault(gram, []).append(term_id)
+        return term_id
+
+    def lookup(self, query, max_distance=None, limit=5, prefix=False):
+        """
+        Find the terms closest to query.
+
+        Parameters:
+        - query (str): Normalized (lowercased) text
+        - max_distance (int): Typos tolerated, default_max_distance(query) by default
+        - limit (int): Maximum matches
+        - prefix (bool): Also match terms that start with a near-copy of query, for partially typed words
+
+        Returns:
+        - list: (term, distance) pairs, closest first
+        """
+        if len(query) < MIN_FUZZY_LENGTH:
+            return []
+        max_distance = default_max_distance(query) if max_distance is None else max_distance
+
+        counts = Counter()
+        for gram in set(trigrams(query)):
+            counts.update(self._grams.get(gram, ()))
+
+        # Look for one-typo matches first: their shared-trigram threshold is strict enough to leave
+        # only a handful of candidates, and a looser search is only needed if there are none.
+        # A typo changes at most three of the query's trigrams, a swap of two letters four.
+        for distance_limit in range(1, max_distance + 1):
+            min_shared = max(1, len(query) - 4 * distance_limit)
+            candidates = sorted(((shared, term_id) for term_id, shared in counts.items() if shared >= min_shared),
+                                reverse=True)[:MAX_CANDIDATES]
+            matches = []
+            for shared, term_id in candidates:
+                term = self.terms[term_id]
+                distance = edit_distance(query, term, distance_limit, prefix)
+                if distance <= distance_limit:
+                    matches.append((distance, -shared, term))
+            if matches:
+                matches.sort()
+                return [(term, distance) for distance, _, term in matches[:limit]]
+        return []
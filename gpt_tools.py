@@ -1,11 +1,8 @@
-import os
-from openai import OpenAI
-import streamlit as st  # Add this import
+from llm_cache import cached_chat_completion
+from prompt_builder import build_referral_messages
+from database import SUMMARY_UNAVAILABLE
 
-# Initialize the OpenAI client using your API key
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-
-def get_gpt4_summary(referral_data):
+def get_gpt4_summary(referral_data, raise_errors=False):
     """
     Generate a clinical summary and suggestions from GPT-4 based on referral data.
 
@@ -13,48 +10,30 @@ def get_gpt4_summary(referral_data):
     - referral_data (dict): A dictionary containing referral fields like
       patient_name, age, gender, clinical_information, diagnosis, reason_for_referral, medical_history, medications
 
+    - raise_errors (bool): Re-raise API errors instead of returning the fallback text,
+      so callers such as the summary job queue can retry
+
     Returns:
     - str: The GPT-4-generated summary and suggestions text
     """
-    prompt = f"""
-You are a clinical decision-support assistant. A referring doctor has submitted a medical referral with the following data:
-
-Patient Name: {referral_data.get('patient_name', 'N/A')}
-Age: {referral_data.get('patient_age', 'N/A')}
-Gender: {referral_data.get('patient_gender', 'N/A')}
-
-Clinical Summary:
-{referral_data.get('clinical_information', 'N/A')}
-
-Working Diagnosis:
-{referral_data.get('diagnosis', 'N/A')}
-
-Reason for Referral:
-{referral_data.get('reason_for_referral', 'N/A')}
-
-Medical History:
-{referral_data.get('medical_history', 'None')}
-
-Current Medications:
-{referral_data.get('medications', 'None')}
-
-Instructions:
-1. Provide a clear summary of the case.
-2. Suggest possible areas the consulting doctor may want to focus on.
-3. Recommend any preliminary actions or questions to consider.
-
-Respond in a concise and professional format.
-    """
+    # Long fields are truncated so the prompt stays within PROMPT_TOKEN_BUDGET
+    prompt = build_referral_messages(referral_data, task='summary')
+    if prompt['truncated']:
+        print(f"Summary prompt truncated to fit the token budget: {', '.join(prompt['truncated'])}")
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
+        # Identical referral data is answered from the response cache
+        response, _ = cached_chat_completion(
+            "gpt-4",
+            prompt['messages'],
+            purpose='summary',
             max_tokens=500,
             temperature=0.7
         )
-        return response.choices[0].message.content.strip()
+        return response.strip()
     except Exception as e:
         print(f"[GPT Error] Failed to generate summary: {e}")
-        return "AI summary unavailable due to a processing error."
+        if raise_errors:
+            raise
+        return SUMMARY_UNAVAILABLE
 
@@ -0,0 +1,190 @@
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+# Load environment variables
+load_dotenv()
+
+# Configuration for upload-time image normalization
+IMAGE_NORMALIZATION_ENABLED = os.getenv("IMAGE_NORMALIZATION_ENABLED", "false").lower() in ("1", "true", "yes")
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", 2048))
+IMAGE_TARGET_FORMAT = os.getenv("IMAGE_TARGET_FORMAT", "WEBP").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+IMAGE_KEEP_ORIGINAL = os.getenv("IMAGE_KEEP_ORIGINAL", "false").lower() in ("1", "true", "yes")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+FORMAT_EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg', 'PNG': '.png'}
+
+# Shared worker pool so a submit request never waits for re-encoding
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-normalize")
+
+def is_normalizable_image(file_name):
+    """Return True if the file is an image type handled by the normalization stage."""
+    return os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS
+
+def normalized_file_name(file_name, target_format=None):
+    """Return the file name an image will have once it has been transcoded."""
+    target_format = target_format or IMAGE_TARGET_FORMAT
+    base_name = os.path.splitext(file_name)[0]
+    return base_name + FORMAT_EXTENSIONS.get(target_format, os.path.splitext(file_name)[1])
+
+def claim_unique_path(directory, file_name):
+    """
+    Create an empty file named file_name in directory, or with a numeric
+    suffix ("scan_1.png") if that name is taken, and return its path.
+
+    Creating the file claims the name atomically, so two uploads or
+    transcodes never overwrite each other.
+    """
+    base_name, extension = os.path.splitext(file_name)
+    candidate, suffix = file_name, 0
+    while True:
+        file_path = os.path.join(directory, candidate)
+        try:
+            with open(file_path, 'xb'):
+                return file_path
+        except FileExistsError:
+            suffix += 1
+            candidate = f"{base_name}_{suffix}{extension}"
+
+def normalize_image(file_path, max_dimension=None, target_format=None, quality=None):
+    """
+    Re-encode an image: apply EXIF orientation, strip metadata, cap the
+    longest side at max_dimension and save in the target format.
+
+    The new image is written to a temporary file first and then moved to
+    its final name, so readers never see a partially written file. When
+    the format keeps the extension the image is replaced in place;
+    otherwise it gets a new, unique name next to the original, which is
+    left for the caller to remove.
+
+    Returns:
+    - dict: path of the normalized image and original and normalized sizes in bytes,
+      or None if the image could not be processed
+    """
+    max_dimension = max_dimension or IMAGE_MAX_DIMENSION
+    target_format = target_format or IMAGE_TARGET_FORMAT
+    quality = quality or IMAGE_QUALITY
+    temp_path = f"{file_path}.tmp"
+
+    try:
+        original_size = os.path.getsize(file_path)
+
+        with Image.open(file_path) as img:
+            # Rotate according to EXIF before the metadata is discarded
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            if target_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                # JPEG has no alpha channel, flatten onto a white background
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                rgba = img.convert('RGBA')
+                background.paste(rgba, mask=rgba.split()[-1])
+                img = background
+
+            save_options = {'optimize': True}
+            if target_format in ('JPEG', 'WEBP'):
+                save_options['quality'] = quality
+            if target_format == 'JPEG':
+                save_options['progressive'] = True
+            if target_format == 'WEBP':
+                save_options['method'] = 4
+
+            # Saving a fresh image without exif= drops the EXIF block
+            img.save(temp_path, format=target_format, **save_options)
+
+        file_name = os.path.basename(file_path)
+        target_name = normalized_file_name(file_name, target_format)
+        if target_name == file_name:
+            normalized_path = file_path
+        else:
+            normalized_path = claim_unique_path(os.path.dirname(file_path), target_name)
+        os.replace(temp_path, normalized_path)
+        normalized_size = os.path.getsize(normalized_path)
+        print(f"Normalized image {file_path} -> {normalized_path}: {original_size} -> {normalized_size} bytes")
+        return {'path': normalized_path, 'original_size': original_size, 'normalized_size': normalized_size}
+
+    except Exception as e:
+        print(f"Image normalization failed for {file_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+def keep_original_copy(file_path):
+    """Copy the uploaded bytes to an originals/ folder next to the attachment."""
+    originals_dir = os.path.join(os.path.dirname(file_path), 'originals')
+    if not os.path.exists(originals_dir):
+        os.makedirs(originals_dir)
+
+    original_path = claim_unique_path(originals_dir, os.path.basename(file_path))
+    shutil.copyfile(file_path, original_path)
+    return original_path
+
+def replace_attachment_path(old_path, new_path, db_path='referral_system.db'):
+    """Point every referral and consultation attachment list at new_path instead of old_path."""
+    conn = sqlite3.connect(db_path)
+    try:
+        for table in ('referrals', 'consultations'):
+            rows = conn.execute(f"SELECT rowid, attachment_paths FROM {table} WHERE attachment_paths LIKE ?",
+                                (f"%{old_path}%",)).fetchall()
+            for rowid, attachment_paths in rows:
+                paths = [new_path if path == old_path else path for path in attachment_paths.split(',')]
+                conn.execute(f"UPDATE {table} SET attachment_paths = ? WHERE rowid = ?", (','.join(paths), rowid))
+        conn.commit()
+    finally:
+        conn.close()
+
+def submit_normalization(file_path, keep_original=None, db_path='referral_system.db'):
+    """
+    Queue a saved attachment for normalization on the background worker pool.
+
+    A transcoded image replaces the upload only once it has been written:
+    the stored attachment path is switched to it and the upload removed.
+    If anything fails the upload stays as it was.
+
+    Parameters:
+    - file_path (str): Attachment path as stored in the database
+    - keep_original (bool): Preserve the untouched upload under originals/
+    - db_path (str): Database holding the attachment paths
+
+    Returns:
+    - Future: resolves to the normalize_image() result
+    """
+    if keep_original is None:
+        keep_original = IMAGE_KEEP_ORIGINAL
+
+    def _run():
+        if keep_original:
+            keep_original_copy(file_path)
+        result = normalize_image(file_path)
+        if result and result['path'] != file_path:
+            try:
+                replace_attachment_path(file_path, result['path'], db_path)
+            except sqlite3.Error as e:
+                print(f"Could not switch attachment {file_path} to {result['path']}: {e}")
+                os.remove(result['path'])
+                return None
+            os.remove(file_path)
+        return result
+
+    return _executor.submit(_run)
+
+def queue_attachment_normalization(file_paths, normalize_images=None, db_path='referral_system.db'):
+    """
+    Queue the images among newly saved attachments for normalization.
+
+    Call once the rows listing file_paths are committed, since each image
+    is renamed after transcoding and its stored path updated.
+
+    Returns:
+    - list: Futures of the queued normalizations
+    """
+    if normalize_images is None:
+        normalize_images = IMAGE_NORMALIZATION_ENABLED
+    if not normalize_images:
+        return []
+    return [submit_normalization(path, db_path=db_path) for path in file_paths if is_normalizable_image(path)]
@@ -0,0 +1,328 @@
+import sqlite3
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+from llm_provider import get_llm_provider, get_llm_breaker
+from prompt_builder import count_tokens, count_message_tokens
+
+# Load environment variables
+load_dotenv()
+
+# Cached completions expire after the TTL; least recently used entries are evicted above the size limit
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL_HOURS = int(os.getenv("LLM_CACHE_TTL_HOURS", 24 * 7))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", 20))
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+# Recent (time to first token, total) latencies of streamed API calls, in seconds
+_latencies = deque(maxlen=200)
+
+def ensure_cache_table(conn):
+    """Create the LLM response cache if it does not exist yet."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed)')
+
+def ensure_usage_table(conn):
+    """Create the per-call token usage log if it does not exist yet."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS llm_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        purpose TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        cached INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_usage_created_at ON llm_usage (created_at)')
+
+def record_usage(purpose, provider, model, messages, response, cached, db_path='referral_system.db'):
+    """
+    Log the prompt and completion tokens of one LLM call.
+
+    Cache hits are logged too (with cached set) so the tokens they saved
+    show up in the usage stats. A failure to log never fails the call.
+    """
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            ensure_usage_table(conn)
+            conn.execute('''
+            INSERT INTO llm_usage (purpose, provider, model, prompt_tokens, completion_tokens, cached)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (purpose, provider, model, count_message_tokens(messages), count_tokens(response), int(cached)))
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Failed to record LLM usage: {e}")
+
+def _normalize(text):
+    """Collapse whitespace so indentation and line wrapping changes do not miss the cache."""
+    return re.sub(r'\s+', ' ', str(text)).strip()
+
+def cache_key(model, messages, provider='openai', **params):
+    """
+    Hash of the provider, model, normalized messages and generation parameters.
+
+    Parameters:
+    - model (str): Model name
+    - messages (list): Chat messages as {'role', 'content'} dicts
+    - provider (str): LLM provider name, so stub responses never answer real requests
+    - params: Other request parameters, e.g. max_tokens and temperature
+
+    Returns:
+    - str: Hex SHA-256 digest
+    """
+    normalized = [{'role': m['role'], 'content': _normalize(m['content'])} for m in messages]
+    data = json.dumps({'provider': provider, 'model': model, 'messages': normalized, 'params': params},
+                      sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def get_cached(key, db_path='referral_system.db'):
+    """Return the cached response for key, or None if missing or expired."""
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_cache_table(conn)
+        row = conn.execute('''
+        SELECT response FROM llm_cache
+        WHERE cache_key = ? AND created_at > datetime('now', ?)
+        ''', (key, f'-{LLM_CACHE_TTL_HOURS} hours')).fetchone()
+        if row:
+            conn.execute("UPDATE llm_cache SET last_accessed = datetime('now') WHERE cache_key = ?", (key,))
+            conn.commit()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def put_cached(key, model, response, db_path='referral_system.db'):
+    """Store a response and evict expired and least recently used entries over the size limit."""
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_cache_table(conn)
+        conn.execute('''
+        INSERT OR REPLACE INTO llm_cache (cache_key, model, response, size, created_at, last_accessed)
+        VALUES (?, ?, ?, ?, datetime('now'), datetime('now'))
+        ''', (key, model, response, len(response.encode('utf-8'))))
+
+        conn.execute("DELETE FROM llm_cache WHERE created_at <= datetime('now', ?)",
+                     (f'-{LLM_CACHE_TTL_HOURS} hours',))
+        conn.execute('''
+        DELETE FROM llm_cache WHERE cache_key IN (
+            SELECT cache_key FROM (
+                SELECT cache_key, SUM(size) OVER (ORDER BY last_accessed DESC, rowid DESC) AS running_size
+                FROM llm_cache
+            ) WHERE running_size > ?
+        )
+        ''', (int(LLM_CACHE_MAX_MB * 1024 * 1024),))
+        conn.commit()
+    finally:
+        conn.close()
+
+def cached_chat_completion(model, messages, purpose='chat', **params):
+    """
+    Run a chat completion through the persistent cache.
+
+    Identical requests (same model, parameters and messages up to
+    whitespace) are answered from the cache without calling the API.
+    Cache misses go through the LLM circuit breaker.
+
+    Raises:
+    - CircuitOpenError: if the provider is failing and the call was skipped
+
+    Parameters:
+    - model (str): Model name
+    - messages (list): Chat messages
+    - purpose (str): Label for the token usage log, e.g. 'summary'
+    - params: Other request parameters, e.g. max_tokens and temperature
+
+    Returns:
+    - tuple: (response text, True if it came from the cache)
+    """
+    provider = get_llm_provider()
+    key = cache_key(model, messages, provider.name, **params)
+    if LLM_CACHE_ENABLED:
+        cached = get_cached(key)
+        if cached is not None:
+            with _stats_lock:
+                _stats['hits'] += 1
+            record_usage(purpose, provider.name, model, messages, cached, True)
+            return cached, True
+
+    with _stats_lock:
+        _stats['misses'] += 1
+    response = get_llm_breaker().call(provider.complete, model, messages, **params)
+    record_usage(purpose, provider.name, model, messages, response, False)
+
+    if LLM_CACHE_ENABLED and response:
+        put_cached(key, model, response)
+    return response, False
+
+def stream_chat_completion(model, messages, metrics=None, purpose='chat', **params):
+    """
+    Stream a chat completion through the persistent cache.
+
+    Yields text as it arrives so the caller can render it incrementally;
+    a cache hit yields the whole response at once. The complete response
+    is stored in the cache when the stream finishes. Cache misses go
+    through the LLM circuit breaker and raise CircuitOpenError while it is open.
+
+    Parameters:
+    - model (str): Model name
+    - messages (list): Chat messages
+    - metrics (dict): Optional, filled with cached, ttft and total (seconds)
+    - purpose (str): Label for the token usage log, e.g. 'recommendations'
+    - params: Other request parameters, e.g. max_tokens and temperature
+    """
+    metrics = metrics if metrics is not None else {}
+    start = time.perf_counter()
+    provider = get_llm_provider()
+    key = cache_key(model, messages, provider.name, **params)
+
+    if LLM_CACHE_ENABLED:
+        cached = get_cached(key)
+        if cached is not None:
+            with _stats_lock:
+                _stats['hits'] += 1
+            metrics.update(cached=True, ttft=time.perf_counter() - start, total=time.perf_counter() - start)
+            record_usage(purpose, provider.name, model, messages, cached, True)
+            yield cached
+            return
+
+    with _stats_lock:
+        _stats['misses'] += 1
+    metrics['cached'] = False
+
+    breaker = get_llm_breaker()
+    breaker.before_call()
+    parts = []
+    succeeded = True
+    try:
+        for delta in provider.stream(model, messages, **params):
+            if not parts:
+                metrics['ttft'] = time.perf_counter() - start
+            parts.append(delta)
+            yield delta
+    except Exception:
+        succeeded = False
+        breaker.record_failure()
+        raise
+    finally:
+        # A stream the caller stopped reading early still counts as a healthy call
+        if succeeded:
+            breaker.record_success()
+
+    metrics['total'] = time.perf_counter() - start
+    metrics.setdefault('ttft', metrics['total'])
+    with _stats_lock:
+        _latencies.append((metrics['ttft'], metrics['total']))
+
+    response = "".join(parts)
+    record_usage(purpose, provider.name, model, messages, response, False)
+    if LLM_CACHE_ENABLED and response:
+        put_cached(key, model, response)
+
+def get_latency_stats():
+    """
+    Latency of recent streamed API calls (cache hits excluded).
+
+    Returns:
+    - dict: samples, average and worst time to first token and total latency in seconds
+    """
+    with _stats_lock:
+        samples = list(_latencies)
+    if not samples:
+        return {'samples': 0, 'avg_ttft': 0, 'max_ttft': 0, 'avg_total': 0, 'max_total': 0}
+    ttfts = [ttft for ttft, _ in samples]
+    totals = [total for _, total in samples]
+    return {
+        'samples': len(samples),
+        'avg_ttft': sum(ttfts) / len(ttfts),
+        'max_ttft': max(ttfts),
+        'avg_total': sum(totals) / len(totals),
+        'max_total': max(totals)
+    }
+
+def peek_cached(model, messages, **params):
+    """Return the cached response for a request without calling the API, or None."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    return get_cached(cache_key(model, messages, get_llm_provider().name, **params))
+
+def get_cache_stats(db_path='referral_system.db'):
+    """
+    Get size and hit rate of the LLM cache.
+
+    Returns:
+    - dict: entries, total bytes, hits and misses in this process, and the hit rate
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_cache_table(conn)
+        entries, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    return {
+        'entries': entries,
+        'bytes': total_bytes,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0
+    }
+
+def get_usage_stats(hours=24, db_path='referral_system.db'):
+    """
+    Get token usage per purpose over the last hours.
+
+    Returns:
+    - dict: purpose -> calls, cached calls, prompt and completion tokens sent
+      to the API, tokens saved by the cache and average prompt size
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_usage_table(conn)
+        rows = conn.execute('''
+        SELECT purpose, COUNT(*), SUM(cached),
+               SUM(CASE WHEN cached THEN 0 ELSE prompt_tokens END),
+               SUM(CASE WHEN cached THEN 0 ELSE completion_tokens END),
+               SUM(CASE WHEN cached THEN prompt_tokens + completion_tokens ELSE 0 END),
+               AVG(prompt_tokens)
+        FROM llm_usage
+        WHERE created_at > datetime('now', ?)
+        GROUP BY purpose
+        ''', (f'-{hours} hours',)).fetchall()
+    finally:
+        conn.close()
+
+    return {
+        purpose: {
+            'calls': calls,
+            'cached_calls': cached_calls,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'tokens_saved': tokens_saved,
+            'avg_prompt_tokens': avg_prompt_tokens
+        }
+        for purpose, calls, cached_calls, prompt_tokens, completion_tokens, tokens_saved, avg_prompt_tokens in rows
+    }
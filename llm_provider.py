@@ -0,0 +1,175 @@
+import os
+import time
+import random
+import hashlib
+import threading
+from dotenv import load_dotenv
+
+from circuit_breaker import CircuitBreaker
+
+# Load environment variables
+load_dotenv()
+
+# Backend used for every LLM call: 'openai', or 'stub' for offline tests and load tests
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+
+# Every call is bounded by this deadline (seconds); streams must finish within it too. Retries
+# share the deadline: each attempt gets LLM_TIMEOUT_SECONDS / (LLM_MAX_RETRIES + 1), plus the
+# client's short backoff between attempts
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 30))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 0))
+
+# After this many consecutive failures LLM calls are skipped for LLM_BREAKER_RESET_SECONDS
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", 5))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", 60))
+
+# Stub backend behaviour
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", 0))  # before the first token
+LLM_STUB_TOKEN_LATENCY_MS = float(os.getenv("LLM_STUB_TOKEN_LATENCY_MS", 0))  # between tokens
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", 0))  # fraction of calls that raise
+
+_provider = None
+_provider_lock = threading.Lock()
+_breaker = CircuitBreaker('LLM provider', LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_SECONDS)
+
+class OpenAIProvider:
+    """
+    Chat completions from the OpenAI API.
+
+    The client is created on first use, so importing the modules that call
+    the LLM does not need an API key or network configuration.
+    """
+
+    name = 'openai'
+
+    def __init__(self, api_key=None, timeout=None):
+        self._api_key = api_key
+        self.timeout = LLM_TIMEOUT_SECONDS if timeout is None else timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_api_key(self):
+        api_key = self._api_key or os.getenv("OPENAI_API_KEY")
+        if api_key:
+            return api_key
+        # Fall back to the Streamlit secrets file when running inside the app
+        import streamlit as st
+        return st.secrets["OPENAI_API_KEY"]
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(api_key=self._get_api_key(), timeout=self.timeout / (LLM_MAX_RETRIES + 1),
+                                      max_retries=LLM_MAX_RETRIES)
+            return self._client
+
+    def complete(self, model, messages, **params):
+        """Return the full completion text."""
+        completion = self.client.chat.completions.create(model=model, messages=messages, **params)
+        return completion.choices[0].message.content
+
+    def stream(self, model, messages, **params):
+        """Yield completion text as it arrives, raising TimeoutError if the stream outlives the deadline."""
+        deadline = time.monotonic() + self.timeout
+        stream = self.client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+        # The check below only runs when a chunk arrives; a stream stalled between chunks is closed
+        # by this timer when the deadline passes, which ends the blocked read
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            stream.close()
+
+        watchdog = threading.Timer(max(0, deadline - time.monotonic()), expire)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            for chunk in stream:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"LLM stream exceeded {self.timeout:g}s")
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            # A stream closed by the timer may simply end early; that is a timeout, not a full response
+            if expired.is_set():
+                raise TimeoutError(f"LLM stream exceeded {self.timeout:g}s")
+        except Exception as e:
+            if isinstance(e, TimeoutError) or not expired.is_set():
+                raise
+            raise TimeoutError(f"LLM stream exceeded {self.timeout:g}s") from e
+        finally:
+            watchdog.cancel()
+            stream.close()
+
+class StubProvider:
+    """
+    Deterministic local backend for tests and load tests.
+
+    The response depends only on the model and messages, so identical
+    requests return identical text. Latency before the first token and
+    between tokens, and an error rate, are configurable.
+    """
+
+    name = 'stub'
+
+    def __init__(self, latency_ms=None, token_latency_ms=None, error_rate=None, timeout=None):
+        self.timeout = LLM_TIMEOUT_SECONDS if timeout is None else timeout
+        self.latency_ms = LLM_STUB_LATENCY_MS if latency_ms is None else latency_ms
+        self.token_latency_ms = LLM_STUB_TOKEN_LATENCY_MS if token_latency_ms is None else token_latency_ms
+        self.error_rate = LLM_STUB_ERROR_RATE if error_rate is None else error_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _tokens(self, model, messages, max_tokens=None, **params):
+        digest = hashlib.sha256(repr((model, [(m['role'], m['content']) for m in messages])).encode()).hexdigest()
+        prompt = messages[-1]['content'].split()
+        words = [f"Stub response {digest[:12]} from {model}."] + prompt[:max(0, (max_tokens or 60) - 1)]
+        return [word + " " for word in words]
+
+    def _start(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency_ms / 1000 > self.timeout:
+            time.sleep(self.timeout)
+            raise TimeoutError(f"Stub LLM call exceeded {self.timeout:g}s")
+        time.sleep(self.latency_ms / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError("Stub LLM provider error")
+
+    def complete(self, model, messages, **params):
+        """Return the full completion text."""
+        self._start()
+        tokens = self._tokens(model, messages, **params)
+        time.sleep(self.token_latency_ms * len(tokens) / 1000)
+        return "".join(tokens).strip()
+
+    def stream(self, model, messages, **params):
+        """Yield completion text one token at a time."""
+        self._start()
+        for i, token in enumerate(self._tokens(model, messages, **params)):
+            if i:
+                time.sleep(self.token_latency_ms / 1000)
+            yield token
+
+PROVIDERS = {'openai': OpenAIProvider, 'stub': StubProvider}
+
+def get_llm_provider():
+    """Return the process-wide LLM provider selected by LLM_PROVIDER, creating it on first use."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if LLM_PROVIDER not in PROVIDERS:
+                raise ValueError(f"Unknown LLM_PROVIDER: {LLM_PROVIDER}")
+            _provider = PROVIDERS[LLM_PROVIDER]()
+        return _provider
+
+def get_llm_breaker():
+    """Return the circuit breaker guarding every LLM provider call."""
+    return _breaker
+
+def set_llm_provider(provider):
+    """Replace the process-wide provider, e.g. with a StubProvider in a load test."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,293 @@
+import os
+import re
+import json
+import time
+import heapq
+import bisect
+import zipfile
+import argparse
+import threading
+from itertools import chain
+from dotenv import load_dotenv
+
+from medication_results import MedicationResults, MAX_DOSAGES
+from fuzzy_index import TrigramIndex
+
+# Load environment variables
+load_dotenv()
+
+# Compact medication list built offline from an OpenFDA bulk download (see build_index)
+MEDICATION_INDEX_PATH = os.getenv("MEDICATION_INDEX_PATH", "medication_index.json")
+# Query the live OpenFDA API for medications the local index does not have
+MEDICATION_REMOTE_LOOKUP = os.getenv("MEDICATION_REMOTE_LOOKUP", "true").lower() in ("1", "true", "yes")
+
+# Listing of the OpenFDA bulk download files
+OPENFDA_DOWNLOADS_URL = "https://api.fda.gov/download.json"
+
+SEARCH_LIMIT = 15
+
+# Used when no index file has been built yet
+COMMON_MEDICATIONS = [
+    {"name": "Aspirin (acetylsalicylic acid)", "dosages": ["81mg Tablet", "325mg Tablet"], "route": "Oral"},
+    {"name": "Atorvastatin (Lipitor)", "dosages": ["10mg Tablet", "20mg Tablet", "40mg Tablet", "80mg Tablet"], "route": "Oral"},
+    {"name": "Lisinopril", "dosages": ["5mg Tablet", "10mg Tablet", "20mg Tablet", "40mg Tablet"], "route": "Oral"},
+    {"name": "Metformin", "dosages": ["500mg Tablet", "850mg Tablet", "1000mg Tablet", "500mg ER Tablet"], "route": "Oral"},
+    {"name": "Amlodipine", "dosages": ["2.5mg Tablet", "5mg Tablet", "10mg Tablet"], "route": "Oral"},
+    {"name": "Metoprolol", "dosages": ["25mg Tablet", "50mg Tablet", "100mg Tablet"], "route": "Oral"},
+    {"name": "Gabapentin", "dosages": ["100mg Capsule", "300mg Capsule", "400mg Capsule", "600mg Tablet"], "route": "Oral"},
+    {"name": "Omeprazole", "dosages": ["10mg Capsule", "20mg Capsule", "40mg Capsule"], "route": "Oral"},
+    {"name": "Prednisone", "dosages": ["5mg Tablet", "10mg Tablet", "20mg Tablet"], "route": "Oral"},
+    {"name": "Ibuprofen", "dosages": ["200mg Tablet", "400mg Tablet", "600mg Tablet", "800mg Tablet"], "route": "Oral"},
+]
+
+_index = None
+_index_lock = threading.Lock()
+
+def tokenize(text):
+    """Lowercase alphanumeric words of a medication name."""
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+class MedicationIndex:
+    """
+    In-memory prefix index over medication names.
+
+    Entries are numbered in ranking order (shorter names first) and every
+    word of every name maps to the ascending list of entries containing it.
+    The words starting with a prefix are a contiguous range of the sorted
+    vocabulary found by binary search. For a one-word query merging their
+    lists yields the matches best first, so the search stops after `limit`
+    however common the prefix is; longer queries intersect the lists as
+    sets. A query matches an entry when each query word is a prefix of
+    some word of the name, e.g. "met hydro" finds "Metformin Hydrochloride".
+    A word matching nothing is replaced by the closest vocabulary words
+    from a trigram index, so "metfromin" still finds "Metformin".
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: (len(entry['name']), entry['name'].lower()))
+        self._lower_names = [entry['name'].lower() for entry in self.entries]
+
+        postings = {}
+        for i, name in enumerate(self._lower_names):
+            for word in set(tokenize(name)):
+                postings.setdefault(word, []).append(i)
+        self._vocabulary = sorted(postings)
+        self._postings = [postings[word] for word in self._vocabulary]
+
+        # Full names in alphabetical order, for names starting with the query
+        by_name = sorted(range(len(self._lower_names)), key=self._lower_names.__getitem__)
+        self._sorted_names = [self._lower_names[i] for i in by_name]
+        self._sorted_name_ids = by_name
+
+        # Trigram index of the vocabulary for misspelled words, built on the first typo
+        self._fuzzy = None
+        self._fuzzy_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _prefix_range(vocabulary, prefix):
+        """Slice of the sorted vocabulary holding the words that start with prefix."""
+        start = bisect.bisect_left(vocabulary, prefix)
+        return start, bisect.bisect_left(vocabulary, prefix + '\uffff', start)
+
+    @staticmethod
+    def _merged_ids(postings):
+        """Ids in several ascending posting lists, in ascending order without duplicates."""
+        previous = None
+        for i in heapq.merge(*postings):
+            if i != previous:
+                previous = i
+                yield i
+
+    def _fuzzy_postings(self, word):
+        """Vocabulary words closest to a misspelled word with their entry lists, closest first."""
+        with self._fuzzy_lock:
+            if self._fuzzy is None:
+                self._fuzzy = TrigramIndex(self._vocabulary)
+        return [(term, self._postings[bisect.bisect_left(self._vocabulary, term)])
+                for term, _ in self._fuzzy.lookup(word, prefix=True)]
+
+    def search(self, query, limit=SEARCH_LIMIT, fuzzy=True):
+        """
+        Find medications by name or word prefix.
+
+        Parameters:
+        - query (str): Search text, e.g. "metf" or "met hydro" (names only, not dosages)
+        - limit (int): Maximum results
+        - fuzzy (bool): Correct query words that match no name, e.g. "metfromin"
+
+        Returns:
+        - list: Medication dicts (name, dosages, route), names starting with the query first;
+          after a correction each also has corrected_from (the query) and corrected_to
+        """
+        words = tokenize(query or "")
+        if not words:
+            return []
+        query = query.strip().lower()
+
+        # Entry lists of the vocabulary words matching each query word
+        postings = {}
+        corrected = {}
+        for word in set(words):
+            start, end = self._prefix_range(self._vocabulary, word)
+            postings[word] = self._postings[start:end]
+            if not postings[word] and fuzzy:
+                matches = self._fuzzy_postings(word)
+                postings[word] = [posting for _, posting in matches]
+                if matches:
+                    corrected[word] = matches[0][0]
+            if not postings[word]:
+                return []
+
+        # Names starting with the query rank first
+        start, end = self._prefix_range(self._sorted_names, query)
+        results = heapq.nsmallest(limit, self._sorted_name_ids[start:end])
+
+        # Then any name with a word matching each query word
+        if len(results) < limit:
+            found = set(results)
+            if len(postings) == 1:
+                # Stream the matching entries best first (closest correction first for a typo)
+                # and stop as soon as there are enough
+                lists = postings[words[0]]
+                for i in (chain.from_iterable(lists) if corrected else self._merged_ids(lists)):
+                    if i not in found:
+                        found.add(i)
+                        results.append(i)
+                        if len(results) == limit:
+                            break
+            else:
+                # Start from the word with the fewest entries and narrow down with the others
+                counts = {word: sum(map(len, lists)) for word, lists in postings.items()}
+                scan_word, *other_words = sorted(postings, key=counts.get)
+                candidates = set().union(*postings[scan_word])
+                for word in other_words:
+                    matched = set()
+                    for posting in postings[word]:
+                        matched |= candidates.intersection(posting)
+                    candidates = matched
+                results += heapq.nsmallest(limit - len(results), candidates - found)
+
+        if corrected:
+            # Flag corrected results, so a similar-sounding name is never shown as an exact match
+            corrected_to = " ".join(corrected.get(word, word) for word in words)
+            return [dict(self.entries[i], corrected_from=query, corrected_to=corrected_to) for i in results]
+        return [self.entries[i] for i in results]
+
+def _records_to_entries(records):
+    """
+    Merge OpenFDA NDC or drug label records into one entry per medication name.
+
+    Returns:
+    - list: Medication dicts in the format of the OpenFDA search results (name, dosages, route)
+    """
+    results = MedicationResults(max_dosages=MAX_DOSAGES)
+    for record in records:
+        # Label records keep the names under 'openfda'; NDC records have them at the top level
+        fields = record.get('openfda') if 'openfda' in record and 'brand_name' not in record else record
+        if not fields:
+            continue
+        ingredients = record.get('active_ingredients') or []
+        strength = ", ".join(ingredient.get('strength', 'N/A') for ingredient in ingredients) or fields.get('strength')
+        route = fields.get('route')
+        results.add_record(fields.get('brand_name'), fields.get('generic_name'), strength,
+                           fields.get('dosage_form'), route[0] if isinstance(route, list) and route else route)
+    return sorted(results.results(), key=lambda entry: entry["name"].lower())
+
+def _read_dump(path):
+    """Yield the result records of an OpenFDA bulk download (.json, or the .json.zip as downloaded)."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.endswith('.json'):
+                    with archive.open(member) as f:
+                        yield from json.load(f).get('results', [])
+    else:
+        with open(path) as f:
+            yield from json.load(f).get('results', [])
+
+def build_index(dump_paths, index_path=MEDICATION_INDEX_PATH):
+    """
+    Build the local medication index file from OpenFDA bulk downloads.
+
+    Parameters:
+    - dump_paths (list): Downloaded drug NDC or drug label files
+    - index_path (str): Output file
+
+    Returns:
+    - int: Number of medications written
+    """
+    records = (record for path in dump_paths for record in _read_dump(path))
+    entries = _records_to_entries(records)
+
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(entries, f, separators=(',', ':'))
+    os.replace(tmp_path, index_path)
+    return len(entries)
+
+def download_dump(dest_dir='.', endpoint='ndc'):
+    """
+    Download the OpenFDA bulk files of a drug endpoint ('ndc' or 'label').
+
+    Returns:
+    - list: Paths of the downloaded zip files
+    """
+    import requests
+
+    listing = requests.get(OPENFDA_DOWNLOADS_URL, timeout=30).json()
+    paths = []
+    for partition in listing['results']['drug'][endpoint]['partitions']:
+        path = os.path.join(dest_dir, os.path.basename(partition['file']))
+        print(f"Downloading {partition['file']}")
+        with requests.get(partition['file'], stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        paths.append(path)
+    return paths
+
+def load_index(index_path=MEDICATION_INDEX_PATH):
+    """Load the index file, falling back to COMMON_MEDICATIONS if it has not been built."""
+    if not os.path.exists(index_path):
+        print(f"Medication index {index_path} not found, using the built-in common medications")
+        return MedicationIndex(COMMON_MEDICATIONS)
+    with open(index_path) as f:
+        return MedicationIndex(json.load(f))
+
+def get_medication_index():
+    """Return the process-wide medication index, loading it on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = load_index()
+        return _index
+
+def search_local_medications(search_term, limit=SEARCH_LIMIT):
+    """Search the local medication index."""
+    return get_medication_index().search(search_term, limit)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local medication index from OpenFDA bulk downloads.")
+    parser.add_argument("dumps", nargs="*", help="Downloaded drug NDC or label files (.json or .json.zip)")
+    parser.add_argument("--download", action="store_true", help="Download the drug NDC files from OpenFDA first")
+    parser.add_argument("--output", default=MEDICATION_INDEX_PATH, help="Index file to write")
+    parser.add_argument("--search", help="Search the built index and print the results and lookup time")
+    args = parser.parse_args()
+
+    if args.search:
+        index = load_index(args.output)
+        start = time.perf_counter()
+        results = index.search(args.search)
+        elapsed = time.perf_counter() - start
+        for result in results:
+            print(f"{result['name']}: {', '.join(result['dosages'][:3])}")
+        print(f"{len(results)} of {len(index)} medications in {elapsed * 1000:.3f} ms")
+    else:
+        dumps = args.dumps + (download_dump() if args.download else [])
+        if not dumps:
+            parser.error("give the downloaded files or --download")
+        print(f"Indexed {build_index(dumps, args.output)} medications into {args.output}")
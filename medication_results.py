@@ -0,0 +1,88 @@
+import re
+from itertools import islice, product
+
+# Bounds on how far one record is expanded, so a label listing many brands and strengths
+# cannot flood the dropdown
+MAX_NAME_VARIANTS = 6
+MAX_DOSAGES = 20
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def _clean(value):
+    return re.sub(r'\s+', ' ', str(value)).strip() if value else ""
+
+def product_names(brand_names, generic_names, limit=MAX_NAME_VARIANTS):
+    """
+    Display names for a product, "Brand (GENERIC)" or just the one that is known.
+
+    Parallel brand and generic lists are paired up; otherwise every
+    combination is taken, up to limit names.
+    """
+    brands = [_clean(name) for name in _as_list(brand_names) if _clean(name)]
+    generics = [_clean(name) for name in _as_list(generic_names) if _clean(name)]
+    if brands and generics:
+        pairs = zip(brands, generics) if len(brands) == len(generics) else product(brands, generics)
+        names = (brand if brand.lower() == generic.lower() else f"{brand} ({generic})" for brand, generic in pairs)
+    else:
+        names = iter(brands or generics)
+    return list(islice(names, limit))
+
+def dosage_labels(strengths, dosage_forms, limit=MAX_DOSAGES):
+    """Dosage labels ("500 mg/1 TABLET") for every strength and form, up to limit."""
+    strengths = [_clean(strength) for strength in _as_list(strengths) if _clean(strength) not in ("", "N/A")] or [""]
+    forms = [_clean(form) for form in _as_list(dosage_forms) if _clean(form)] or [""]
+    labels = (f"{strength} {form}".strip() for strength, form in product(strengths, forms))
+    return [label for label in islice(labels, limit) if label]
+
+class MedicationResults:
+    """
+    Collects medication products into one entry per name.
+
+    Entries are found by a hash of the normalized name and each keeps a set
+    of its dosages, so adding n products costs O(n) however many share a
+    name. Dosages of the same product are grouped under one entry, capped
+    at max_dosages.
+    """
+
+    def __init__(self, max_results=None, max_dosages=MAX_DOSAGES):
+        self.max_results = max_results
+        self.max_dosages = max_dosages
+        self._entries = {}
+        self._dosage_sets = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name, dosages, route=None):
+        """Add a product, or its dosages to the entry already holding its name."""
+        name = _clean(name)
+        if not name:
+            return
+        key = name.lower()
+        entry = self._entries.get(key)
+        if entry is None:
+            if self.max_results is not None and len(self._entries) >= self.max_results:
+                return
+            entry = self._entries[key] = {"name": name, "dosages": [], "route": _clean(route).title() or "Oral"}
+            self._dosage_sets[key] = set()
+
+        seen = self._dosage_sets[key]
+        for dosage in dosages:
+            if len(entry["dosages"]) >= self.max_dosages:
+                break
+            if dosage not in seen:
+                seen.add(dosage)
+                entry["dosages"].append(dosage)
+
+    def add_record(self, brand_names, generic_names, strengths, dosage_forms, route=None):
+        """Add every name variant of one OpenFDA record with its dosages."""
+        dosages = dosage_labels(strengths, dosage_forms, self.max_dosages)
+        for name in product_names(brand_names, generic_names):
+            self.add(name, dosages, route)
+
+    def results(self):
+        """Entries in the order first seen, each with at least one dosage."""
+        return [dict(entry, dosages=entry["dosages"] or ["N/A"]) for entry in self._entries.values()]
@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+from medication_index import search_local_medications, tokenize, MEDICATION_REMOTE_LOOKUP
+from openfda_client import cached_search, normalize_query
+from medication_results import MAX_DOSAGES
+
+# Load environment variables
+load_dotenv()
+
+# A search returns whatever has arrived by this deadline (seconds); slower API calls finish in the
+# background and warm the OpenFDA cache for the next search
+MEDICATION_SEARCH_DEADLINE_SECONDS = float(os.getenv("MEDICATION_SEARCH_DEADLINE_SECONDS", 1.5))
+MEDICATION_SEARCH_WORKERS = int(os.getenv("MEDICATION_SEARCH_WORKERS", 8))
+MAX_RESULTS = 25
+
+# Lower is better when two sources return the same medication
+SOURCE_PRIORITY = {'local': 0, 'label': 1, 'ndc': 2, 'label_first_word': 3}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MEDICATION_SEARCH_WORKERS,
+                                           thread_name_prefix="medication-search")
+        return _executor
+
+def _merge(merged, source, results):
+    """Add one source's results to merged (keyed on the lowercased name), combining dosages."""
+    for result in results:
+        key = result['name'].lower()
+        entry = merged.get(key)
+        if entry is None:
+            merged[key] = dict(result, dosages=list(result['dosages']), sources=[source])
+            continue
+        entry['sources'].append(source)
+        if 'corrected_to' not in result:
+            # An exact match from any source outweighs a correction from another
+            entry.pop('corrected_from', None)
+            entry.pop('corrected_to', None)
+        seen = set(entry['dosages'])
+        new_dosages = [dosage for dosage in result['dosages'] if dosage not in seen]
+        entry['dosages'] += new_dosages[:max(0, MAX_DOSAGES - len(entry['dosages']))]
+
+def rank_results(query, merged):
+    """
+    Order merged results for the dropdown.
+
+    Names starting with the query come first, then names with a word
+    starting with each query word, then the rest, and results for a
+    corrected misspelling after all of them; ties go to the most trusted
+    source and then to the shorter name.
+    """
+    query = normalize_query(query)
+    words = tokenize(query)
+
+    def score(entry):
+        name = entry['name'].lower()
+        name_words = tokenize(name)
+        word_match = all(any(w.startswith(word) for w in name_words) for word in words)
+        return ('corrected_to' in entry, not name.startswith(query), not word_match,
+                min(SOURCE_PRIORITY[source] for source in entry['sources']), len(name), name)
+
+    return sorted(merged.values(), key=score)
+
+def search_medications(search_term, deadline=None, metrics=None):
+    """
+    Search the local index and both OpenFDA endpoints at once.
+
+    The local index answers immediately; the label and NDC searches (and,
+    for several words, a label search on the first word) run concurrently
+    and are merged as they arrive. The search returns when every source
+    has answered or the deadline has passed, whichever comes first.
+
+    Parameters:
+    - search_term (str): Medication name as typed
+    - deadline (float): Latency budget in seconds, MEDICATION_SEARCH_DEADLINE_SECONDS by default
+    - metrics (dict): Optional, filled with elapsed (seconds), answered and timed_out source lists
+
+    Returns:
+    - list: Medication dicts (name, dosages, route, sources), best match first
+    """
+    metrics = metrics if metrics is not None else {}
+    start = time.perf_counter()
+    deadline = MEDICATION_SEARCH_DEADLINE_SECONDS if deadline is None else deadline
+    if not search_term or len(search_term.strip()) < 3:
+        return []
+
+    merged = {}
+    _merge(merged, 'local', search_local_medications(search_term))
+    answered = ['local']
+
+    pending = {}
+    if MEDICATION_REMOTE_LOOKUP:
+        executor = _get_executor()
+        pending = {
+            executor.submit(cached_search, 'label', search_term): 'label',
+            executor.submit(cached_search, 'ndc', search_term): 'ndc'
+        }
+        first_word = search_term.split()[0]
+        if first_word != search_term.strip() and len(first_word) >= 3:
+            pending[executor.submit(cached_search, 'label', first_word)] = 'label_first_word'
+
+    while pending:
+        remaining = deadline - (time.perf_counter() - start)
+        if remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            source = pending.pop(future)
+            try:
+                _merge(merged, source, future.result())
+                answered.append(source)
+            except Exception as e:
+                print(f"Medication search source {source} failed: {e}")
+
+    metrics.update(elapsed=time.perf_counter() - start, answered=answered, timed_out=list(pending.values()))
+    return rank_results(search_term, merged)[:MAX_RESULTS]
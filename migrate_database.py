@@ -3,6 +3,8 @@ import os
 import json
 from datetime import datetime
 
+from database import ensure_missing_summary_index
+
 def backup_database():
     """Create a backup of the current database"""
     if os.path.exists('referral_system.db'):
@@ -40,7 +42,9 @@ def migrate_database():
             'creation_date': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
             'last_updated': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
             'priority': 'INTEGER DEFAULT 0',
-            'gpt_summary': 'TEXT'  # ✅ New column for GPT-4 summary
+            'gpt_summary': 'TEXT',  # ✅ New column for GPT-4 summary
+            'gpt_summary_status': 'TEXT',
+            'gpt_summary_hash': 'TEXT'
         }
         
         for column_name, column_type in new_columns.items():
@@ -92,6 +96,108 @@ def migrate_database():
         )
         ''')
 
+        # === Create attachment_archive table if not exists ===
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS attachment_archive (
+            path TEXT PRIMARY KEY,
+            segment_path TEXT NOT NULL,
+            original_size INTEGER NOT NULL,
+            compressed_size INTEGER NOT NULL,
+            archived_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        # === Create email_outbox table if not exists ===
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            next_attempt_at TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox (status, id)')
+
+        # === Update email_outbox table ===
+        c.execute("PRAGMA table_info(email_outbox)")
+        outbox_columns = {info[1]: info for info in c.fetchall()}
+        
+        new_outbox_columns = {
+            'next_attempt_at': 'TIMESTAMP'
+        }
+        
+        for column_name, column_type in new_outbox_columns.items():
+            if column_name not in outbox_columns:
+                print(f"Adding column {column_name} to email_outbox table")
+                c.execute(f"ALTER TABLE email_outbox ADD COLUMN {column_name} {column_type}")
+
+        # === Create summary_jobs table if not exists ===
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS summary_jobs (
+            id INTEGER PRIMARY KEY,
+            referral_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            next_attempt_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (referral_id) REFERENCES referrals (referral_id)
+        )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_summary_jobs_status ON summary_jobs (status, id)')
+
+        # Partial index of referrals still missing an AI summary, used by backfill_summaries.py
+        ensure_missing_summary_index(c)
+
+        # === Create llm_cache table if not exists ===
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed)')
+
+        # === Create llm_usage table if not exists ===
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            purpose TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cached INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_llm_usage_created_at ON llm_usage (created_at)')
+
+        # === Create openfda_cache table if not exists ===
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS openfda_cache (
+            endpoint TEXT NOT NULL,
+            query TEXT NOT NULL,
+            results TEXT NOT NULL,
+            hits INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (endpoint, query)
+        )
+        ''')
+
         c.execute("COMMIT")
         print("Database migration completed successfully!")
         return True
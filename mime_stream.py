@@ -0,0 +1,101 @@
+import os
+import re
+import uuid
+import base64
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.policy import SMTP
+from dotenv import load_dotenv
+
+from cold_storage import open_attachment, attachment_size
+
+# Load environment variables
+load_dotenv()
+
+# Attachments larger than this are linked from the message body instead of attached
+EMAIL_ATTACHMENT_MAX_BYTES = int(os.getenv("EMAIL_ATTACHMENT_MAX_BYTES", 10 * 1024 * 1024))
+# Where recipients can download linked attachments (the referral system itself)
+APP_BASE_URL = os.getenv("APP_BASE_URL", "")
+
+# Multiple of 57 bytes so every chunk encodes to whole 76-character base64 lines
+ENCODE_CHUNK_SIZE = 57 * 1024
+
+def plan_attachments(paths, max_bytes=None):
+    """
+    Split attachments into those sent inline and those linked instead.
+
+    Returns:
+    - tuple: ([(path, size)] to attach, [(path, size)] to link)
+    """
+    if max_bytes is None:
+        max_bytes = EMAIL_ATTACHMENT_MAX_BYTES
+
+    attach, link = [], []
+    for path in paths:
+        size = attachment_size(path)
+        (attach if size <= max_bytes else link).append((path, size))
+    return attach, link
+
+def linked_attachments_note(linked):
+    """Plain-text paragraph listing attachments that were too large to send."""
+    if not linked:
+        return ""
+    lines = [f"- {os.path.basename(path)} ({size / (1024 * 1024):.1f} MB)" for path, size in linked]
+    where = APP_BASE_URL or "the Doctor Referral System"
+    return ("\n\nThe following files were too large to attach and can be downloaded from "
+            f"{where}:\n" + "\n".join(lines) + "\n")
+
+def _quote_periods(data):
+    """SMTP dot-stuffing: double any period that starts a line."""
+    return re.sub(br'(?m)^\.', b'..', data)
+
+def _iter_base64(path):
+    """Yield the base64 body of an attachment in fixed-size, CRLF-terminated chunks."""
+    with open_attachment(path) as f:
+        while True:
+            chunk = f.read(ENCODE_CHUNK_SIZE)
+            if not chunk:
+                return
+            encoded = base64.b64encode(chunk)
+            # base64 output never starts a line with '.', so no dot-stuffing is needed here
+            yield b"".join(encoded[i:i + 76] + b"\r\n" for i in range(0, len(encoded), 76))
+
+def _part_headers(path):
+    name = os.path.basename(path)
+    part = MIMEBase('application', 'octet-stream', name=name)
+    del part['MIME-Version']
+    part['Content-Transfer-Encoding'] = 'base64'
+    part['Content-Disposition'] = f'attachment; filename="{name}"'
+    return part.as_bytes(policy=SMTP)
+
+def iter_message(headers, body, attachment_paths):
+    """
+    Yield an SMTP DATA payload as bytes chunks, encoding attachments as they are read.
+
+    Only the headers and the text/HTML body are held in memory; each
+    attachment is read and base64-encoded ENCODE_CHUNK_SIZE bytes at a
+    time, so memory per send stays bounded regardless of attachment size.
+    The payload is already dot-stuffed and CRLF-terminated, but does not
+    include the final '.' line.
+
+    Parameters:
+    - headers (dict): From, To, Subject and any other top-level headers
+    - body (email.message.Message): The text/HTML part of the message
+    - attachment_paths (list): Attachments to stream
+    """
+    boundary = f"=============={uuid.uuid4().hex}=="
+    msg = MIMEMultipart('mixed', boundary=boundary)
+    for name, value in headers.items():
+        msg[name] = value
+    msg.attach(body)
+
+    # Everything up to the closing boundary is small; attachment parts are spliced in before it
+    closing = f"--{boundary}--".encode()
+    data = msg.as_bytes(policy=SMTP)
+    yield _quote_periods(data[:data.rindex(closing)])
+
+    for path in attachment_paths:
+        yield f"--{boundary}\r\n".encode() + _part_headers(path)
+        yield from _iter_base64(path)
+
+    yield closing + b"\r\n"
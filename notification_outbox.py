@@ -0,0 +1,412 @@
+import sqlite3
+import os
+import json
+import smtplib
+import threading
+import argparse
+from dotenv import load_dotenv
+
+from email_service import send_referral_notification, send_consultation_notification, send_referral_digest
+from backoff import retry_delay
+
+# Load environment variables
+load_dotenv()
+
+# Referral notifications to the same recipient are coalesced over this window (0 disables digests)
+EMAIL_DIGEST_WINDOW_MINUTES = int(os.getenv("EMAIL_DIGEST_WINDOW_MINUTES", 0))
+
+# Failed deliveries are retried with exponential backoff and jitter, then dead-lettered
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 6))
+EMAIL_RETRY_BASE_SECONDS = int(os.getenv("EMAIL_RETRY_BASE_SECONDS", 30))
+EMAIL_RETRY_MAX_SECONDS = int(os.getenv("EMAIL_RETRY_MAX_SECONDS", 3600))
+
+OUTBOX_POLL_INTERVAL = 2  # seconds between polls when the queue is empty
+OUTBOX_BATCH_SIZE = 20
+STALE_SENDING_MINUTES = 10  # rows claimed by a worker that died are requeued after this
+
+_worker_thread = None
+_worker_lock = threading.Lock()
+_stop_event = threading.Event()
+
+def enqueue_notification(c, kind, recipient, payload):
+    """
+    Add a notification to the outbox using the caller's cursor.
+
+    The row is written in the caller's transaction, so the notification is
+    committed (or rolled back) together with the referral or consultation
+    that triggered it.
+
+    In digest mode, non-emergency referral notifications are held and later
+    sent as one summary email per recipient (see process_digests()).
+
+    Parameters:
+    - c (sqlite3.Cursor): Cursor of the open write transaction
+    - kind (str): 'referral' or 'consultation'
+    - recipient (str): Email address to notify
+    - payload (dict): JSON-serializable data needed to build the email
+
+    Returns:
+    - int: The outbox row id
+    """
+    held = (EMAIL_DIGEST_WINDOW_MINUTES > 0 and kind == 'referral'
+            and payload.get('urgency') != 'Emergency')
+
+    c.execute('''
+    INSERT INTO email_outbox (kind, recipient, payload, status)
+    VALUES (?, ?, ?, ?)
+    ''', (kind, recipient, json.dumps(payload), 'held' if held else 'queued'))
+    return c.lastrowid
+
+def is_prepared(payload):
+    """
+    True if the payload carries everything needed to render the email.
+
+    The write path stores the fields it already has in hand; older rows
+    only hold ids and are rendered by reading the referral back.
+    """
+    return 'patient_name' in payload
+
+def deliver_notification(kind, recipient, payload):
+    """Build and send a single queued notification. Raises on delivery failure, returns the result dict."""
+    prepared = payload if is_prepared(payload) else None
+    if kind == 'referral':
+        return send_referral_notification(recipient, payload['referral_id'], raise_errors=True,
+                                          referral=prepared)
+    if kind == 'consultation':
+        return send_consultation_notification(recipient, payload['referral_id'], payload['status'],
+                                              raise_errors=True, consultation=prepared)
+    raise ValueError(f"Unknown notification kind: {kind}")
+
+def is_transient_error(error):
+    """
+    Decide whether a failed delivery is worth retrying.
+
+    Connection problems, 4xx SMTP replies and a locked database are
+    transient. 5xx replies (other than authentication failures, which are
+    usually a temporary configuration problem), refused recipients,
+    missing attachments and other errors building the message are
+    permanent.
+    """
+    if isinstance(error, sqlite3.OperationalError):
+        # e.g. "database is locked" while loading what the message needs
+        return True
+    if isinstance(error, (FileNotFoundError, IsADirectoryError, NotADirectoryError)):
+        # A missing attachment is an OSError but never appears by retrying
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPException, OSError))
+
+def _claim_batch(conn, batch_size):
+    """Atomically mark up to batch_size queued rows as sending and return them."""
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute('''
+        SELECT id, kind, recipient, payload FROM email_outbox
+        WHERE status = 'queued' AND (next_attempt_at IS NULL OR next_attempt_at <= datetime('now'))
+        ORDER BY id
+        LIMIT ?
+        ''', (batch_size,))
+        rows = c.fetchall()
+
+        if rows:
+            placeholders = ", ".join(["?" for _ in rows])
+            c.execute(f'''
+            UPDATE email_outbox SET status = 'sending', attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+            WHERE id IN ({placeholders})
+            ''', [row[0] for row in rows])
+
+        c.execute("COMMIT")
+        return rows
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+
+def requeue_stale(conn):
+    """Return rows stuck in 'sending' (e.g. after a crash) to the queue."""
+    c = conn.cursor()
+    c.execute('''
+    UPDATE email_outbox SET status = 'queued'
+    WHERE status = 'sending' AND claimed_at < datetime('now', ?)
+    ''', (f'-{STALE_SENDING_MINUTES} minutes',))
+    conn.commit()
+    return c.rowcount
+
+def process_outbox(batch_size=OUTBOX_BATCH_SIZE, db_path='referral_system.db'):
+    """
+    Deliver one batch of queued notifications.
+
+    Returns:
+    - int: Number of notifications processed
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        rows = _claim_batch(conn, batch_size)
+
+        for outbox_id, kind, recipient, payload in rows:
+            try:
+                deliver_notification(kind, recipient, json.loads(payload))
+                error = None
+            except Exception as e:
+                error = e
+
+            _record_result(conn, [outbox_id], error)
+
+        return len(rows)
+    finally:
+        conn.close()
+
+def _record_result(conn, outbox_ids, error=None):
+    """
+    Record the outcome of a delivery for one or more outbox rows.
+
+    Failed rows are requeued with a backoff delay while the error is
+    transient and attempts remain; otherwise they move to the 'dead' state.
+    """
+    placeholders = ", ".join(["?" for _ in outbox_ids])
+    if error is None:
+        conn.execute(f'''
+        UPDATE email_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+        WHERE id IN ({placeholders})
+        ''', list(outbox_ids))
+        return
+
+    transient = is_transient_error(error)
+    rows = conn.execute(f'SELECT id, attempts FROM email_outbox WHERE id IN ({placeholders})',
+                        list(outbox_ids)).fetchall()
+
+    for outbox_id, attempts in rows:
+        if transient and attempts < EMAIL_MAX_ATTEMPTS:
+            delay = retry_delay(attempts, EMAIL_RETRY_BASE_SECONDS, EMAIL_RETRY_MAX_SECONDS)
+            print(f"Outbox delivery {outbox_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+            conn.execute('''
+            UPDATE email_outbox SET status = 'queued', last_error = ?, next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+            ''', (str(error), f'+{int(delay)} seconds', outbox_id))
+        else:
+            print(f"Outbox delivery {outbox_id} dead-lettered after {attempts} attempts: {error}")
+            conn.execute('''
+            UPDATE email_outbox SET status = 'dead', last_error = ?
+            WHERE id = ?
+            ''', (str(error), outbox_id))
+
+def process_digests(window_minutes=None, db_path='referral_system.db'):
+    """
+    Send one digest per recipient whose oldest held notification is older than the window.
+
+    Returns:
+    - int: Number of held notifications delivered
+    """
+    if window_minutes is None:
+        window_minutes = EMAIL_DIGEST_WINDOW_MINUTES
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        c = conn.cursor()
+        c.execute('''
+        SELECT recipient FROM email_outbox
+        WHERE status = 'held'
+        GROUP BY recipient
+        HAVING MIN(created_at) <= datetime('now', ?)
+        ''', (f'-{window_minutes} minutes',))
+        recipients = [row[0] for row in c.fetchall()]
+
+        processed = 0
+        for recipient in recipients:
+            # Claim every held row for the recipient, including ones that arrived late in the window
+            c.execute("BEGIN IMMEDIATE")
+            c.execute('''
+            SELECT id, payload FROM email_outbox
+            WHERE status = 'held' AND recipient = ?
+            ORDER BY id
+            ''', (recipient,))
+            rows = c.fetchall()
+            outbox_ids = [row[0] for row in rows]
+            if outbox_ids:
+                placeholders = ", ".join(["?" for _ in outbox_ids])
+                c.execute(f'''
+                UPDATE email_outbox SET status = 'sending', attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+                WHERE id IN ({placeholders})
+                ''', outbox_ids)
+            c.execute("COMMIT")
+
+            if not rows:
+                continue
+
+            payloads = [json.loads(payload) for _, payload in rows]
+            referral_ids = [payload['referral_id'] for payload in payloads]
+            prepared = payloads if all(is_prepared(payload) for payload in payloads) else None
+            try:
+                if len(referral_ids) == 1:
+                    send_referral_notification(recipient, referral_ids[0], raise_errors=True,
+                                               referral=prepared[0] if prepared else None)
+                else:
+                    send_referral_digest(recipient, referral_ids, raise_errors=True, referrals=prepared)
+                error = None
+            except Exception as e:
+                error = e
+
+            # Failed digests are retried as individual queued notifications
+            _record_result(conn, outbox_ids, error)
+            processed += len(outbox_ids)
+
+        return processed
+    finally:
+        conn.close()
+
+def run_worker(poll_interval=OUTBOX_POLL_INTERVAL, stop_event=None, db_path='referral_system.db'):
+    """Deliver outbox notifications until stop_event is set."""
+    stop_event = stop_event or threading.Event()
+
+    conn = sqlite3.connect(db_path)
+    requeue_stale(conn)
+    conn.close()
+
+    while not stop_event.is_set():
+        try:
+            processed = process_outbox(db_path=db_path)
+            if EMAIL_DIGEST_WINDOW_MINUTES > 0:
+                processed += process_digests(db_path=db_path)
+        except Exception as e:
+            print(f"Outbox worker error: {e}")
+            processed = 0
+
+        if not processed:
+            stop_event.wait(poll_interval)
+
+def start_outbox_worker(poll_interval=OUTBOX_POLL_INTERVAL):
+    """
+    Start the background delivery thread once per process.
+
+    Safe to call on every Streamlit rerun; later calls are no-ops while the
+    worker is alive.
+    """
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return _worker_thread
+
+        _stop_event.clear()
+        _worker_thread = threading.Thread(
+            target=run_worker,
+            kwargs={'poll_interval': poll_interval, 'stop_event': _stop_event},
+            name="email-outbox-worker",
+            daemon=True
+        )
+        _worker_thread.start()
+        return _worker_thread
+
+def stop_outbox_worker(timeout=10):
+    """Ask the background delivery thread to stop and wait for it."""
+    _stop_event.set()
+    if _worker_thread is not None:
+        _worker_thread.join(timeout)
+
+def list_dead_letters(limit=100, db_path='referral_system.db'):
+    """Return the most recent dead-lettered notifications as dicts."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute('''
+    SELECT id, kind, recipient, payload, attempts, last_error, created_at
+    FROM email_outbox
+    WHERE status = 'dead'
+    ORDER BY id DESC
+    LIMIT ?
+    ''', (limit,))
+    rows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return rows
+
+def replay_dead_letters(outbox_ids=None, db_path='referral_system.db'):
+    """
+    Requeue dead-lettered notifications for immediate delivery.
+
+    Parameters:
+    - outbox_ids (list): Rows to replay; all dead letters when None
+
+    Returns:
+    - int: Number of notifications requeued
+    """
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    if outbox_ids is None:
+        c.execute('''
+        UPDATE email_outbox SET status = 'queued', attempts = 0, next_attempt_at = NULL
+        WHERE status = 'dead'
+        ''')
+    else:
+        placeholders = ", ".join(["?" for _ in outbox_ids])
+        c.execute(f'''
+        UPDATE email_outbox SET status = 'queued', attempts = 0, next_attempt_at = NULL
+        WHERE status = 'dead' AND id IN ({placeholders})
+        ''', list(outbox_ids))
+    conn.commit()
+    requeued = c.rowcount
+    conn.close()
+    return requeued
+
+def get_outbox_stats(db_path='referral_system.db'):
+    """
+    Get queue depth and delivery latency for the email outbox.
+
+    Returns:
+    - dict: counts per status, queue depth, age of the oldest queued
+      notification and delivery latency (seconds) over the last 24 hours
+    """
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    c.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status')
+    status_counts = dict(c.fetchall())
+
+    c.execute('''
+    SELECT (julianday('now') - julianday(MIN(created_at))) * 86400
+    FROM email_outbox WHERE status IN ('queued', 'held', 'sending')
+    ''')
+    oldest_queued_age = c.fetchone()[0] or 0
+
+    c.execute('''
+    SELECT AVG((julianday(sent_at) - julianday(created_at)) * 86400),
+           MAX((julianday(sent_at) - julianday(created_at)) * 86400)
+    FROM email_outbox
+    WHERE status = 'sent' AND sent_at > datetime('now', '-1 day')
+    ''')
+    avg_latency, max_latency = c.fetchone()
+
+    conn.close()
+    return {
+        'status_counts': status_counts,
+        'queue_depth': sum(status_counts.get(status, 0) for status in ('queued', 'held', 'sending')),
+        'oldest_queued_age': oldest_queued_age,
+        'avg_delivery_latency': avg_latency or 0,
+        'max_delivery_latency': max_latency or 0
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deliver queued email notifications.")
+    parser.add_argument("--once", action="store_true", help="Drain the queue once and exit")
+    parser.add_argument("--stats", action="store_true", help="Print outbox statistics and exit")
+    parser.add_argument("--replay-dead", action="store_true", help="Requeue all dead-lettered notifications")
+    args = parser.parse_args()
+
+    if args.replay_dead:
+        print(f"Requeued {replay_dead_letters()} dead-lettered notifications")
+    elif args.stats:
+        stats = get_outbox_stats()
+        print(f"Queue depth: {stats['queue_depth']} (oldest {stats['oldest_queued_age']:.1f}s)")
+        print(f"Status counts: {stats['status_counts']}")
+        print(f"Delivery latency (24h): avg {stats['avg_delivery_latency']:.2f}s, "
+              f"max {stats['max_delivery_latency']:.2f}s")
+    elif args.once:
+        while process_outbox():
+            pass
+        if EMAIL_DIGEST_WINDOW_MINUTES > 0:
+            process_digests()
+    else:
+        run_worker()
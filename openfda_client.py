@@ -0,0 +1,281 @@
+import sqlite3
+import os
+import re
+import json
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+from medication_results import MedicationResults
+from fuzzy_index import TrigramIndex
+
+# Load environment variables
+load_dotenv()
+
+# Every request gives up after these many seconds to connect / to read the response
+OPENFDA_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENFDA_CONNECT_TIMEOUT_SECONDS", 3))
+OPENFDA_READ_TIMEOUT_SECONDS = float(os.getenv("OPENFDA_READ_TIMEOUT_SECONDS", 5))
+OPENFDA_POOL_SIZE = int(os.getenv("OPENFDA_POOL_SIZE", 10))
+
+# Search results are cached in the database, shared by every session and process
+OPENFDA_CACHE_TTL_HOURS = int(os.getenv("OPENFDA_CACHE_TTL_HOURS", 24))
+
+LABEL_API_URL = "https://api.fda.gov/drug/label.json"
+NDC_API_URL = "https://api.fda.gov/drug/ndc.json"
+SEARCH_LIMIT = 15
+
+_session = None
+_session_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'errors': 0, 'fuzzy_hits': 0}
+_stats_lock = threading.Lock()
+# Trigram indexes of cached queries per (database, endpoint), for misspelled searches
+_query_indexes = {}
+_fuzzy_lock = threading.Lock()
+
+def get_session():
+    """
+    Return the shared OpenFDA HTTP session, creating it on first use.
+
+    Connections are kept alive and reused across searches, and connection
+    errors and 429/5xx responses are retried once with a short backoff.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=1, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=("GET",))
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=OPENFDA_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def normalize_query(search_term):
+    """Lowercase and collapse whitespace, so "Metformin " and "metformin" share a cache entry."""
+    return re.sub(r'\s+', ' ', search_term or "").strip().lower()
+
+def ensure_openfda_cache_table(conn):
+    """Create the OpenFDA search cache if it does not exist yet."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS openfda_cache (
+        endpoint TEXT NOT NULL,
+        query TEXT NOT NULL,
+        results TEXT NOT NULL,
+        hits INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (endpoint, query)
+    )
+    ''')
+
+def get_cached_results(endpoint, query, db_path='referral_system.db'):
+    """Return the cached results of a normalized query, or None if missing or expired."""
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_openfda_cache_table(conn)
+        row = conn.execute('''
+        SELECT results FROM openfda_cache
+        WHERE endpoint = ? AND query = ? AND created_at > datetime('now', ?)
+        ''', (endpoint, query, f'-{OPENFDA_CACHE_TTL_HOURS} hours')).fetchone()
+        if row:
+            conn.execute('UPDATE openfda_cache SET hits = hits + 1 WHERE endpoint = ? AND query = ?',
+                         (endpoint, query))
+            conn.commit()
+        return json.loads(row[0]) if row else None
+    finally:
+        conn.close()
+
+def put_cached_results(endpoint, query, results, db_path='referral_system.db'):
+    """Store the results of a normalized query and drop expired entries."""
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_openfda_cache_table(conn)
+        conn.execute('''
+        INSERT OR REPLACE INTO openfda_cache (endpoint, query, results, hits, created_at)
+        VALUES (?, ?, ?, 0, datetime('now'))
+        ''', (endpoint, query, json.dumps(results)))
+        conn.execute("DELETE FROM openfda_cache WHERE created_at <= datetime('now', ?)",
+                     (f'-{OPENFDA_CACHE_TTL_HOURS} hours',))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _as_first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+def _ingredient_strength(record):
+    """Strength of a product, joining the strengths of combination products ("5 mg/1, 10 mg/1")."""
+    ingredients = record.get('active_ingredients') or []
+    return ", ".join(ingredient.get('strength', 'N/A') for ingredient in ingredients) or None
+
+def _parse_label_results(data):
+    """Medication dicts (name, dosages, route) from a drug label API response."""
+    results = MedicationResults()
+    for result in data.get('results', []):
+        fields = result.get('openfda')
+        if not fields:
+            continue
+        results.add_record(fields.get('brand_name', ["Unknown"]), fields.get('generic_name'),
+                           fields.get('strength'), fields.get('dosage_form', ["Tablet"]),
+                           _as_first(fields.get('route')))
+    return results.results()
+
+def _parse_ndc_results(data):
+    """Medication dicts (name, dosages, route) from a drug NDC API response."""
+    results = MedicationResults()
+    for result in data.get('results', []):
+        results.add_record(result.get('brand_name', "Unknown"), result.get('generic_name'),
+                           _ingredient_strength(result), result.get('dosage_form', "Tablet"),
+                           _as_first(result.get('route')))
+    return results.results()
+
+ENDPOINTS = {
+    'label': (LABEL_API_URL, "(openfda.brand_name:{term} OR openfda.generic_name:{term})", _parse_label_results),
+    'ndc': (NDC_API_URL, "(brand_name:{term} OR generic_name:{term})", _parse_ndc_results)
+}
+
+def _query_index(endpoint, db_path):
+    """Trigram index of the earlier queries with results, loaded from the cache on first use."""
+    with _fuzzy_lock:
+        key = (db_path, endpoint)
+        if key not in _query_indexes:
+            conn = sqlite3.connect(db_path)
+            try:
+                ensure_openfda_cache_table(conn)
+                rows = conn.execute("SELECT query FROM openfda_cache WHERE endpoint = ? AND results != '[]'",
+                                    (endpoint,)).fetchall()
+            finally:
+                conn.close()
+            _query_indexes[key] = TrigramIndex(query for query, in rows)
+        return _query_indexes[key]
+
+def find_similar_cached(endpoint, query, db_path='referral_system.db'):
+    """
+    Cached results of an earlier query one typo away from a query OpenFDA found no match for.
+
+    Returns:
+    - tuple: (similar query, its results), or (None, []) if no close query has results
+    """
+    for similar, _ in _query_index(endpoint, db_path).lookup(query, max_distance=1):
+        results = get_cached_results(endpoint, similar, db_path)
+        if results:
+            return similar, results
+    return None, []
+
+def _fetch_results(endpoint, query):
+    """Query the API, returning None if the request failed or the response could not be parsed."""
+    url, search, parse = ENDPOINTS[endpoint]
+    try:
+        response = get_session().get(url, params={"search": search.format(term=query), "limit": SEARCH_LIMIT},
+                                     timeout=(OPENFDA_CONNECT_TIMEOUT_SECONDS, OPENFDA_READ_TIMEOUT_SECONDS))
+    except requests.RequestException as e:
+        print(f"OpenFDA {endpoint} search for '{query}' failed: {e}")
+        return None
+
+    # OpenFDA answers 404 when nothing matches
+    if response.status_code == 404:
+        return []
+    if response.status_code == 200:
+        try:
+            return parse(response.json())
+        except Exception as e:
+            # A body that is not JSON or not shaped as expected
+            print(f"Unreadable response from OpenFDA {endpoint} API for '{query}': {e}")
+            return None
+    print(f"Error from OpenFDA {endpoint} API ({response.status_code}): {response.text[:200]}")
+    return None
+
+def cached_search(endpoint, search_term, db_path='referral_system.db'):
+    """
+    Search an OpenFDA drug endpoint through the persistent cache.
+
+    When OpenFDA has no match for the query (typically a misspelling)
+    the cached results of an earlier query one typo away are returned
+    instead, marked with corrected_from (the query) and corrected_to. A
+    failed API call never falls back to another query.
+
+    Parameters:
+    - endpoint (str): 'label' or 'ndc'
+    - search_term (str): Medication name as typed
+    - db_path (str): SQLite database holding the cache
+
+    Returns:
+    - list: Medication dicts (name, dosages, route); empty if nothing matched or the API failed
+    """
+    query = normalize_query(search_term)
+    try:
+        results = get_cached_results(endpoint, query, db_path)
+    except sqlite3.Error as e:
+        # e.g. the database is locked by a background worker; search the API instead
+        print(f"OpenFDA cache lookup for '{query}' failed: {e}")
+        results = None
+    if results is not None:
+        with _stats_lock:
+            _stats['hits'] += 1
+    else:
+        with _stats_lock:
+            _stats['misses'] += 1
+        results = _fetch_results(endpoint, query)
+        if results is None:
+            with _stats_lock:
+                _stats['errors'] += 1
+            return []
+        try:
+            # Empty results are cached too, so a miss is not repeated until the entry expires
+            put_cached_results(endpoint, query, results, db_path)
+        except sqlite3.Error as e:
+            # The results are still good, they are just not cached this time
+            with _stats_lock:
+                _stats['errors'] += 1
+            print(f"Could not cache OpenFDA {endpoint} results for '{query}': {e}")
+        else:
+            if results:
+                with _fuzzy_lock:
+                    query_index = _query_indexes.get((db_path, endpoint))
+                    if query_index is not None:
+                        query_index.add(query)
+
+    # An empty list (cached or fresh) is OpenFDA's "no match" answer; a failure returned above
+    if not results:
+        try:
+            similar, similar_results = find_similar_cached(endpoint, query, db_path)
+        except sqlite3.Error as e:
+            print(f"OpenFDA cache lookup for queries similar to '{query}' failed: {e}")
+            similar, similar_results = None, []
+        if similar_results:
+            with _stats_lock:
+                _stats['fuzzy_hits'] += 1
+            print(f"OpenFDA {endpoint} search for '{query}' answered with cached results for '{similar}'")
+            return [dict(result, corrected_from=query, corrected_to=similar) for result in similar_results]
+    return results
+
+def get_openfda_cache_stats(db_path='referral_system.db'):
+    """
+    Get size and hit rate of the OpenFDA search cache.
+
+    Returns:
+    - dict: cached queries, hits recorded across all processes, and this
+      process's hits, misses, API errors, misspellings answered from a
+      similar query and hit rate
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_openfda_cache_table(conn)
+        entries, total_hits = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM openfda_cache WHERE created_at > datetime('now', ?)
+        ''', (f'-{OPENFDA_CACHE_TTL_HOURS} hours',)).fetchone()
+    finally:
+        conn.close()
+
+    with _stats_lock:
+        hits, misses, errors, fuzzy_hits = _stats['hits'], _stats['misses'], _stats['errors'], _stats['fuzzy_hits']
+    return {
+        'entries': entries,
+        'total_hits': total_hits,
+        'hits': hits,
+        'misses': misses,
+        'errors': errors,
+        'fuzzy_hits': fuzzy_hits,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0
+    }
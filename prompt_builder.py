@@ -0,0 +1,254 @@
+import os
+import re
+import threading
+from dotenv import load_dotenv
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Load environment variables
+load_dotenv()
+
+# Upper bound on the prompt sent for a referral (system and user message); long fields are cut to fit
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))
+PROMPT_MAX_LIST_ITEMS = int(os.getenv("PROMPT_MAX_LIST_ITEMS", 25))
+
+CHARS_PER_TOKEN = 4  # rough English average, used when tiktoken is not installed
+TRUNCATION_MARKER = " [...] "
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+SYSTEM_PROMPT = "You are a clinical decision-support assistant helping a consulting doctor review a medical referral."
+
+REFERRAL_TEMPLATE = """A referring doctor has submitted a medical referral with the following data:
+
+Patient Name: {patient_name}
+Age: {patient_age}
+Gender: {patient_gender}
+
+Clinical Summary:
+{clinical_information}
+
+Working Diagnosis:
+{diagnosis}
+
+Reason for Referral:
+{reason_for_referral}
+
+Medical History:
+{medical_history}
+
+Current Medications:
+{medications}
+
+Allergies:
+{allergies}
+
+Instructions:
+{instructions}"""
+
+TASK_INSTRUCTIONS = {
+    'summary': (
+        "1. Provide a clear summary of the case.\n"
+        "2. Suggest possible areas the consulting doctor may want to focus on.\n"
+        "3. Recommend any preliminary actions or questions to consider.\n\n"
+        "Respond in a concise and professional format."
+    ),
+    'recommendations': (
+        "Generate a concise medical consultation summary and actionable recommendations "
+        "for the consulting doctor."
+    )
+}
+
+# Free-text fields that share the budget; the patient header and instructions are always sent in full
+BUDGETED_FIELDS = ('clinical_information', 'diagnosis', 'reason_for_referral',
+                   'medical_history', 'medications', 'allergies')
+
+def _get_encoding():
+    """Return the tiktoken encoding, or None to fall back to the character estimate."""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            if tiktoken is not None:
+                try:
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    # The encoding file is downloaded on first use and may be unavailable offline
+                    print(f"tiktoken encoding unavailable, estimating token counts: {e}")
+        return _encoding
+
+def count_tokens(text):
+    """Number of tokens in text (exact with tiktoken, otherwise estimated from its length)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def count_message_tokens(messages):
+    """Tokens in a list of chat messages, including the few tokens of per-message overhead."""
+    return sum(count_tokens(message['content']) + 4 for message in messages) + 2
+
+def compact_text(value):
+    """
+    Flatten a field into compact prompt text.
+
+    Lists are joined one item per line with duplicates dropped and at most
+    PROMPT_MAX_LIST_ITEMS kept; runs of spaces and blank lines are collapsed.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        items = []
+        seen = set()
+        for item in value:
+            item = compact_text(item)
+            if item and item.lower() not in seen:
+                seen.add(item.lower())
+                items.append(item)
+        if len(items) > PROMPT_MAX_LIST_ITEMS:
+            items = items[:PROMPT_MAX_LIST_ITEMS] + [f"(+{len(items) - PROMPT_MAX_LIST_ITEMS} more)"]
+        return "\n".join(f"- {item}" for item in items)
+    text = re.sub(r'[ \t]+', ' ', str(value))
+    return re.sub(r'\n\s*\n+', '\n', text).strip()
+
+def _keep_ends(text, keep):
+    """Text with only about keep tokens left, two thirds from its start and the rest from its end."""
+    head = keep * 2 // 3
+    tail = keep - head
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        start = encoding.decode(tokens[:head])
+        end = encoding.decode(tokens[len(tokens) - tail:]) if tail else ""
+    else:
+        start = text[:head * CHARS_PER_TOKEN]
+        end = text[len(text) - tail * CHARS_PER_TOKEN:] if tail else ""
+        # Cut at word boundaries rather than mid-word
+        if ' ' in start:
+            start = start.rsplit(' ', 1)[0]
+        if ' ' in end:
+            end = end.split(' ', 1)[1]
+    return start.rstrip() + TRUNCATION_MARKER + end.lstrip()
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Shorten text to at most max_tokens, keeping its beginning and end.
+
+    The start of a clinical note usually states the problem and the end the
+    latest findings, so the middle is dropped and marked with [...]. An
+    allowance too small for anything but the marker gives "".
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max_tokens - count_tokens(TRUNCATION_MARKER)
+    while keep > 0:
+        # Tokens merge differently where the pieces are joined, so check and shave off any excess
+        shortened = _keep_ends(text, keep)
+        excess = count_tokens(shortened) - max_tokens
+        if excess <= 0:
+            return shortened
+        keep -= excess
+    return ""
+
+def allocate_budget(sizes, budget):
+    """
+    Split a token budget between fields.
+
+    Fields smaller than an equal share keep their full size and the rest of
+    the budget is divided evenly among the larger ones.
+
+    Parameters:
+    - sizes (dict): Field name to token count
+    - budget (int): Tokens available for all fields
+
+    Returns:
+    - dict: Field name to allowed tokens
+    """
+    allowance = {}
+    remaining = max(0, budget)
+    ordered = sorted(sizes.items(), key=lambda item: item[1])
+    for i, (name, size) in enumerate(ordered):
+        share = remaining // (len(ordered) - i)
+        allowance[name] = min(size, share)
+        remaining -= allowance[name]
+    return allowance
+
+def build_referral_messages(referral, task='summary', budget=None):
+    """
+    Build the chat messages for a referral prompt within a token budget.
+
+    Both the background summary and the consultation recommendations use
+    this template; only the instructions differ. Fields are compacted and,
+    if the prompt would exceed the budget, the longest are truncated.
+    The returned prompt_tokens never exceed the budget.
+
+    Parameters:
+    - referral (dict): Referral fields (patient_name, patient_age, patient_gender and BUDGETED_FIELDS)
+    - task (str): 'summary' or 'recommendations'
+    - budget (int): Maximum prompt tokens, PROMPT_TOKEN_BUDGET by default
+
+    Returns:
+    - dict: messages, prompt_tokens and the names of truncated fields
+
+    Raises:
+    - ValueError: if the budget cannot even hold the patient header and instructions
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    fields = {name: compact_text(referral.get(name)) for name in BUDGETED_FIELDS}
+    # An age of 0 (an infant) is a real value, only a missing one is N/A
+    patient_age = referral.get('patient_age')
+    header = {
+        'patient_name': referral.get('patient_name') or 'N/A',
+        'patient_age': 'N/A' if patient_age is None or patient_age == '' else patient_age,
+        'patient_gender': referral.get('patient_gender') or 'N/A',
+        'instructions': TASK_INSTRUCTIONS[task]
+    }
+
+    truncated = []
+
+    def render():
+        # An empty field reads "Not provided"; one cut down to nothing is still marked as cut
+        values = {name: text or (TRUNCATION_MARKER.strip() if name in truncated else 'Not provided')
+                  for name, text in fields.items()}
+        return [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': REFERRAL_TEMPLATE.format(**header, **values)}
+        ]
+
+    # Tokens used by everything except the field values, counted as rendered
+    fixed_tokens = count_message_tokens(render()) - sum(count_tokens(text) for text in fields.values())
+
+    sizes = {name: count_tokens(text) for name, text in fields.items()}
+    if fixed_tokens + sum(sizes.values()) > budget:
+        allowance = allocate_budget(sizes, budget - fixed_tokens)
+        for name, text in fields.items():
+            if sizes[name] > allowance[name]:
+                fields[name] = truncate_to_tokens(text, allowance[name])
+                truncated.append(name)
+
+    messages = render()
+    prompt_tokens = count_message_tokens(messages)
+    # Counting the fields apart is not exact where they meet the template; cut the longest field further
+    while prompt_tokens > budget and any(fields.values()):
+        name = max(fields, key=lambda field: count_tokens(fields[field]))
+        fields[name] = truncate_to_tokens(fields[name], count_tokens(fields[name]) - (prompt_tokens - budget))
+        if name not in truncated:
+            truncated.append(name)
+        messages = render()
+        prompt_tokens = count_message_tokens(messages)
+    if prompt_tokens > budget:
+        raise ValueError(f"Prompt token budget of {budget} is too small for the referral header ({prompt_tokens} tokens)")
+
+    return {
+        'messages': messages,
+        'prompt_tokens': prompt_tokens,
+        'truncated': truncated
+    }
@@ -3,39 +3,54 @@ from datetime import datetime
 import sqlite3
 import uuid
 import os
-import streamlit as st
-from email_service import send_referral_notification
+from notification_outbox import enqueue_notification
+from email_service import publish_referral_preview
+from image_processing import claim_unique_path, queue_attachment_normalization
 
-# ✅ Import GPT summary function
-from gpt_tools import get_gpt4_summary
+# ✅ Import GPT summary job queue
+from summary_jobs import enqueue_summary
 
 def save_uploaded_file(uploaded_file, doctor_id, referral_id):
-    """Save an uploaded file to a directory and return the file path."""
+    """
+    Save an uploaded file to a directory and return the file path.
+
+    The file keeps its uploaded name, with a numeric suffix if a file of
+    that name already exists. Images are normalized later, once the
+    caller has committed the path (see queue_attachment_normalization).
+    """
     if not os.path.exists('uploads'):
         os.makedirs('uploads')
-    
+
     directory = f'uploads/{doctor_id}/{referral_id}'
     if not os.path.exists(directory):
         os.makedirs(directory)
-    
-    file_path = os.path.join(directory, uploaded_file.name)
+
+    file_path = claim_unique_path(directory, uploaded_file.name)
     with open(file_path, "wb") as f:
         f.write(uploaded_file.getbuffer())
-    
+
     return file_path
 
     
 def create_referral(referring_doctor_id, referred_doctor_email, patient_details, clinical_info, 
-                    diagnosis, reason, urgency, notes, uploaded_files, additional_details=None):
-    """Create a new referral in the database with dynamic column handling."""
+                    diagnosis, reason, urgency, notes, uploaded_files, additional_details=None, preview_sink=None):
+    """
+    Create a new referral in the database with dynamic column handling.
+
+    The queued notification is previewed through preview_sink (or the
+    registered email preview sink) from the same payload, without reading
+    the referral back.
+    """
     conn = sqlite3.connect('referral_system.db')
     c = conn.cursor()
     
     try:
-        # Check if the referred doctor exists in the system
-        c.execute('SELECT id FROM users WHERE email = ?', (referred_doctor_email,))
-        referred_doctor = c.fetchone()
-        referred_doctor_id = referred_doctor[0] if referred_doctor else None
+        # Check if the referred doctor exists in the system, and get the referring doctor's
+        # name for the notification in the same round trip
+        c.execute('''
+        SELECT (SELECT id FROM users WHERE email = ?), (SELECT full_name FROM users WHERE id = ?)
+        ''', (referred_doctor_email, referring_doctor_id))
+        referred_doctor_id, referring_doctor_name = c.fetchone()
         
         # Generate unique referral ID
         referral_id = str(uuid.uuid4())
@@ -54,24 +69,6 @@ def create_referral(referring_doctor_id, referred_doctor_email, patient_details,
         c.execute("PRAGMA table_info(referrals)")
         columns = [info[1] for info in c.fetchall()]
         
-        # ✅ Generate GPT summary based on referral data
-        gpt_summary = None
-        if 'gpt_summary' in columns:
-            try:
-                gpt_input = {
-                    'patient_name': patient_details['name'],
-                    'patient_age': patient_details['age'],
-                    'patient_gender': patient_details['gender'],
-                    'clinical_information': clinical_info,
-                    'diagnosis': diagnosis,
-                    'reason_for_referral': reason,
-                    'medical_history': additional_details.get('medical_history') if additional_details else "",
-                    'medications': additional_details.get('medications') if additional_details else ""
-                }
-                gpt_summary = get_gpt4_summary(gpt_input)
-            except Exception as e:
-                print(f"GPT Summary generation failed: {e}")
-        
         # Build dynamic insert query
         query_columns = ["referral_id", "referring_doctor_id", "referred_doctor_id", "referred_doctor_email",
                          "patient_name", "patient_age", "patient_gender", "patient_id",
@@ -103,10 +100,6 @@ def create_referral(referring_doctor_id, referred_doctor_email, patient_details,
         if 'last_updated' in columns:
             query_columns.append("last_updated")
             query_values.append(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        
-        if 'gpt_summary' in columns:
-            query_columns.append("gpt_summary")
-            query_values.append(gpt_summary)
 
         # Construct the SQL query
         placeholders = ", ".join(["?" for _ in query_values])
@@ -132,10 +125,27 @@ def create_referral(referring_doctor_id, referred_doctor_email, patient_details,
         
         c.execute(log_sql, log_values)
         
+        # ✅ Queue the GPT summary; it is generated in the background once the referral is committed
+        if 'gpt_summary' in columns and 'gpt_summary_status' in columns:
+            enqueue_summary(c, referral_id)
+        
+        # Queue the email notification in the same transaction as the referral, with everything
+        # the email needs so delivery does not read the referral back
+        notification_payload = {
+            'referral_id': referral_id,
+            'urgency': urgency,
+            'patient_name': patient_details['name'],
+            'reason_for_referral': reason,
+            'referring_doctor': referring_doctor_name
+        }
+        enqueue_notification(c, 'referral', referred_doctor_email, notification_payload)
+        
         conn.commit()
         
-        # Send email notification
-        send_referral_notification(referred_doctor_email, referral_id)
+        # Re-encode image attachments in the background now that their paths are stored
+        queue_attachment_normalization(file_paths)
+        
+        publish_referral_preview(referred_doctor_email, notification_payload, preview_sink)
         
         return referral_id
         
@@ -0,0 +1,184 @@
+import sqlite3
+import os
+import json
+import zipfile
+import argparse
+from dotenv import load_dotenv
+
+from referral import get_referral_details
+from cold_storage import open_attachment, attachment_size
+from storage_maintenance import normalize_attachment_path
+
+# Load environment variables
+load_dotenv()
+
+CHUNK_SIZE = 1024 * 1024
+# Streamlit's download button holds the whole packet in memory, so packets larger than this
+# are not offered in the app and are exported from the command line instead
+PACKET_DOWNLOAD_MAX_BYTES = int(os.getenv("PACKET_DOWNLOAD_MAX_BYTES", 100 * 1024 * 1024))
+
+class _ChunkSink:
+    """Write-only file object that collects zip output until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _packet_entries(referral):
+    """
+    Yield (arcname, kind, value) entries for a referral packet.
+
+    kind is 'json' or 'text' for structured content, 'file' for attachments
+    which are streamed from storage when the entry is written.
+    """
+    referral = dict(referral)
+    consultation = referral.pop('consultation', None)
+
+    if referral.get('additional_details'):
+        try:
+            referral['additional_details'] = json.loads(referral['additional_details'])
+        except (TypeError, ValueError):
+            pass
+
+    gpt_summary = referral.pop('gpt_summary', None)
+    yield 'referral.json', 'json', referral
+
+    if gpt_summary:
+        yield 'ai_summary.txt', 'text', gpt_summary
+
+    if referral.get('attachment_paths'):
+        for path in referral['attachment_paths'].split(','):
+            yield f"attachments/{os.path.basename(normalize_attachment_path(path))}", 'file', path
+
+    if consultation:
+        yield 'consultation.json', 'json', consultation
+        if consultation.get('attachment_paths'):
+            for path in consultation['attachment_paths'].split(','):
+                yield f"consultation_attachments/{os.path.basename(normalize_attachment_path(path))}", 'file', path
+
+def iter_referral_packet(referral_id):
+    """
+    Generate a ZIP packet for a referral as a stream of byte chunks.
+
+    The packet holds the structured referral fields, the AI summary, the
+    consultation response and all attachments. Attachments are copied one at
+    a time in fixed-size chunks and each compressed chunk is yielded as soon
+    as it is produced, so memory use does not grow with attachment size.
+    """
+    referral = get_referral_details(referral_id)
+    sink = _ChunkSink()
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for arcname, kind, value in _packet_entries(referral):
+            if kind == 'json':
+                zf.writestr(arcname, json.dumps(value, indent=2, default=str))
+                continue
+            if kind == 'text':
+                zf.writestr(arcname, value)
+                continue
+
+            try:
+                with open_attachment(value) as src, zf.open(arcname, 'w', force_zip64=True) as dest:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            except FileNotFoundError:
+                zf.writestr(f"{arcname}.missing.txt", f"Attachment {value} could not be found in storage.")
+
+            data = sink.drain()
+            if data:
+                yield data
+
+    # Central directory written on close
+    data = sink.drain()
+    if data:
+        yield data
+
+def estimate_packet_size(referral_id):
+    """
+    Bytes of attachments a referral packet would hold, before compression.
+
+    Attachments are mostly images and PDFs that barely compress, so this is
+    close to the packet size.
+    """
+    referral = get_referral_details(referral_id)
+    total = 0
+    for _, kind, value in _packet_entries(referral):
+        if kind == 'file':
+            try:
+                total += attachment_size(value)
+            except FileNotFoundError:
+                pass
+    return total
+
+def write_referral_packet(referral_id, fileobj):
+    """Write a referral ZIP packet to fileobj, see iter_referral_packet()."""
+    for chunk in iter_referral_packet(referral_id):
+        fileobj.write(chunk)
+
+def export_packets(start_date, end_date, output_dir, db_path='referral_system.db'):
+    """
+    Write one packet per referral created between start_date and end_date (inclusive).
+
+    Returns:
+    - list: paths of the packets written
+    """
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('''
+    SELECT referral_id FROM referrals
+    WHERE date(creation_date) BETWEEN date(?) AND date(?)
+    ORDER BY creation_date
+    ''', (start_date, end_date))
+    referral_ids = [row[0] for row in c.fetchall()]
+    conn.close()
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    written = []
+    for referral_id in referral_ids:
+        packet_path = os.path.join(output_dir, f"referral_{referral_id}.zip")
+        with open(packet_path, 'wb') as f:
+            write_referral_packet(referral_id, f)
+        written.append(packet_path)
+        print(f"Exported {packet_path}")
+
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export referral packets for a date range.")
+    parser.add_argument("start_date", nargs="?", help="First creation date to include (YYYY-MM-DD)")
+    parser.add_argument("end_date", nargs="?", help="Last creation date to include (YYYY-MM-DD)")
+    parser.add_argument("--referral-id", help="Export this referral only, e.g. one too large to download in the app")
+    parser.add_argument("--output-dir", default="exports", help="Directory to write packets to")
+    args = parser.parse_args()
+
+    if args.referral_id:
+        if not os.path.exists(args.output_dir):
+            os.makedirs(args.output_dir)
+        packet_path = os.path.join(args.output_dir, f"referral_{args.referral_id}.zip")
+        with open(packet_path, 'wb') as f:
+            write_referral_packet(args.referral_id, f)
+        print(f"Exported {packet_path}")
+    elif args.start_date and args.end_date:
+        packets = export_packets(args.start_date, args.end_date, args.output_dir)
+        print(f"Exported {len(packets)} referral packets to {args.output_dir}")
+    else:
+        parser.error("give a date range or --referral-id")
@@ -0,0 +1,182 @@
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+class SMTPConnectionPool:
+    """
+    Pool of authenticated SMTP sessions that are reused across messages.
+
+    Opening a session costs a TCP connect, STARTTLS and AUTH; a pooled session
+    pays that once and then sends many messages. Sessions that have been idle
+    for a while are checked with NOOP before reuse, and sessions that are
+    too old, have sent too many messages or fail are replaced.
+    """
+
+    def __init__(self, host, port, username="", password="", use_tls=True, max_size=4,
+                 timeout=30, max_idle_seconds=60, noop_after_seconds=5, max_messages_per_connection=100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle_seconds = max_idle_seconds
+        self.noop_after_seconds = noop_after_seconds
+        self.max_messages_per_connection = max_messages_per_connection
+
+        self._idle = []  # list of (server, last_used, messages_sent)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.stats = {'connects': 0, 'reuses': 0, 'noop_checks': 0, 'discarded': 0, 'messages': 0}
+
+    def _connect(self):
+        """Open and authenticate a new SMTP session."""
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()  # Secure the connection
+        if self.username:
+            server.login(self.username, self.password)
+        with self._lock:
+            self.stats['connects'] += 1
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, server):
+        """Check an idle session with NOOP."""
+        with self._lock:
+            self.stats['noop_checks'] += 1
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self):
+        """Return (server, messages_sent) for a healthy session, reusing an idle one when possible."""
+        while True:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+
+            if entry is None:
+                return self._connect(), 0
+
+            server, last_used, messages_sent = entry
+            idle_for = time.monotonic() - last_used
+
+            if idle_for > self.max_idle_seconds:
+                self._discard(server)
+                continue
+            if idle_for > self.noop_after_seconds and not self._is_alive(server):
+                self._discard(server)
+                continue
+
+            with self._lock:
+                self.stats['reuses'] += 1
+            return server, messages_sent
+
+    def _discard(self, server):
+        with self._lock:
+            self.stats['discarded'] += 1
+        self._close(server)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a session from the pool.
+
+        The session is returned to the pool when the block exits normally and
+        discarded if the block raises, since its state is then unknown.
+        """
+        self._slots.acquire()
+        server = None
+        try:
+            server, messages_sent = self._checkout()
+            yield server
+        except Exception:
+            if server is not None:
+                self._discard(server)
+                server = None
+            raise
+        finally:
+            if server is not None:
+                messages_sent += 1
+                if messages_sent >= self.max_messages_per_connection:
+                    self._discard(server)
+                else:
+                    with self._lock:
+                        self._idle.append((server, time.monotonic(), messages_sent))
+            self._slots.release()
+
+    def send_message(self, msg, from_addr=None, to_addrs=None):
+        """
+        Send an email.message.Message over a pooled session.
+
+        A session the server dropped between checks is replaced and the send
+        is retried once.
+        """
+        for attempt in range(2):
+            try:
+                with self.connection() as server:
+                    server.send_message(msg, from_addr, to_addrs)
+                with self._lock:
+                    self.stats['messages'] += 1
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                if attempt == 1:
+                    raise
+
+    def send_chunks(self, from_addr, to_addrs, make_chunks):
+        """
+        Send a message whose DATA payload is produced incrementally.
+
+        make_chunks() must return an iterable of already dot-stuffed,
+        CRLF-terminated bytes (see mime_stream.iter_message()). It is called
+        again if the session has to be replaced, so the payload is never
+        buffered in full.
+        """
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+
+        for attempt in range(2):
+            try:
+                with self.connection() as server:
+                    server.ehlo_or_helo_if_needed()
+                    code, resp = server.mail(from_addr)
+                    if code != 250:
+                        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+                    for to_addr in to_addrs:
+                        code, resp = server.rcpt(to_addr)
+                        if code not in (250, 251):
+                            raise smtplib.SMTPRecipientsRefused({to_addr: (code, resp)})
+
+                    code, resp = server.docmd("DATA")
+                    if code != 354:
+                        raise smtplib.SMTPDataError(code, resp)
+                    for chunk in make_chunks():
+                        server.send(chunk)
+                    code, resp = server.docmd(".")
+                    if code != 250:
+                        raise smtplib.SMTPDataError(code, resp)
+                with self._lock:
+                    self.stats['messages'] += 1
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                if attempt == 1:
+                    raise
+
+    def close_all(self):
+        """Close every idle session."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _, _ in idle:
+            self._close(server)
@@ -0,0 +1,184 @@
+import sqlite3
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+UPLOADS_DIR = 'uploads'
+
+def normalize_attachment_path(path):
+    """Normalize a stored attachment path so it can be compared with paths on disk."""
+    # Older rows were written on Windows and use backslash separators
+    return os.path.normpath(path.strip().replace('\\', '/'))
+
+def get_referenced_attachments(conn):
+    """Return the set of all attachment paths referenced by referrals and consultations."""
+    c = conn.cursor()
+    c.execute('''
+    SELECT attachment_paths FROM referrals WHERE attachment_paths IS NOT NULL AND attachment_paths != ''
+    UNION ALL
+    SELECT attachment_paths FROM consultations WHERE attachment_paths IS NOT NULL AND attachment_paths != ''
+    ''')
+
+    referenced = set()
+    for (paths,) in c.fetchall():
+        for path in paths.split(','):
+            if path.strip():
+                referenced.add(normalize_attachment_path(path))
+    return referenced
+
+def get_archived_attachments(conn):
+    """Return (archived paths, archive segment paths) from the cold storage index."""
+    c = conn.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'attachment_archive'")
+    if c.fetchone() is None:
+        return set(), set()
+
+    c.execute('SELECT path, segment_path FROM attachment_archive')
+    rows = c.fetchall()
+    return ({row[0] for row in rows}, {os.path.normpath(row[1]) for row in rows})
+
+def _scan_directory(directory):
+    """Walk one directory tree and return a list of (path, size, mtime) tuples."""
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Removed while we were scanning
+                continue
+            files.append((os.path.normpath(path), stat.st_size, stat.st_mtime))
+    return files
+
+def scan_uploads(uploads_dir=UPLOADS_DIR, workers=8):
+    """
+    Walk the uploads tree with a thread pool, one task per doctor directory.
+
+    Returns:
+    - dict: doctor directory name -> list of (path, size, mtime) tuples
+    """
+    if not os.path.exists(uploads_dir):
+        return {}
+
+    entries = list(os.scandir(uploads_dir))
+    doctor_dirs = [entry for entry in entries if entry.is_dir()]
+    loose_files = [entry for entry in entries if entry.is_file()]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_scan_directory, [entry.path for entry in doctor_dirs])
+        scanned = {entry.name: files for entry, files in zip(doctor_dirs, results)}
+
+    if loose_files:
+        scanned[''] = [(os.path.normpath(entry.path), entry.stat().st_size, entry.stat().st_mtime)
+                       for entry in loose_files]
+    return scanned
+
+def _is_referenced(path, referenced, referenced_dirs):
+    """Check a file on disk against the referenced attachment set."""
+    if path in referenced:
+        return True
+    # Kept originals (see image_processing) belong to their attachment directory
+    parent = os.path.dirname(path)
+    if os.path.basename(parent) == 'originals':
+        return os.path.dirname(parent) in referenced_dirs
+    return False
+
+def reconcile_uploads(uploads_dir=UPLOADS_DIR, workers=8, grace_minutes=60, db_path='referral_system.db'):
+    """
+    Compare the uploads tree with the attachments referenced in the database.
+
+    Files younger than grace_minutes are never reported as orphans, because a
+    referral that is still being created has written its files but not yet
+    committed its row.
+
+    Returns:
+    - dict: orphans, missing files and per-doctor storage usage
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        referenced = get_referenced_attachments(conn)
+        archived, segments = get_archived_attachments(conn)
+    finally:
+        conn.close()
+
+    # Archive segments written by cold_storage hold attachments that are no longer on disk
+    referenced_dirs = {os.path.dirname(path) for path in referenced}
+    referenced = referenced | segments
+    scanned = scan_uploads(uploads_dir, workers)
+    cutoff = time.time() - grace_minutes * 60
+
+    on_disk = set()
+    orphans = []
+    usage = {}
+    for doctor, files in scanned.items():
+        doctor_usage = {'files': 0, 'bytes': 0, 'orphan_files': 0, 'orphan_bytes': 0}
+        for path, size, mtime in files:
+            on_disk.add(path)
+            doctor_usage['files'] += 1
+            doctor_usage['bytes'] += size
+            if not _is_referenced(path, referenced, referenced_dirs) and mtime < cutoff:
+                orphans.append((path, size))
+                doctor_usage['orphan_files'] += 1
+                doctor_usage['orphan_bytes'] += size
+        usage[doctor] = doctor_usage
+
+    missing = sorted(path for path in referenced if path not in on_disk and path not in archived)
+
+    return {
+        'orphans': sorted(orphans),
+        'missing': missing,
+        'usage': usage
+    }
+
+def delete_orphans(orphans, uploads_dir=UPLOADS_DIR):
+    """Delete orphaned files and prune directories left empty. Returns bytes freed."""
+    freed = 0
+    for path, size in orphans:
+        try:
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            continue
+
+        # Remove now-empty parent directories up to the uploads root
+        parent = os.path.dirname(path)
+        while os.path.normpath(parent) != os.path.normpath(uploads_dir):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+    return freed
+
+def print_report(report):
+    """Print a human readable reconciliation report."""
+    print("Storage usage per doctor:")
+    for doctor, doctor_usage in sorted(report['usage'].items()):
+        label = doctor or '(uploads root)'
+        print(f" - {label}: {doctor_usage['files']} files, {doctor_usage['bytes'] / 1024 / 1024:.2f} MB "
+              f"({doctor_usage['orphan_files']} orphaned, {doctor_usage['orphan_bytes'] / 1024 / 1024:.2f} MB)")
+
+    print(f"\nOrphaned files: {len(report['orphans'])}")
+    for path, size in report['orphans']:
+        print(f" - {path} ({size} bytes)")
+
+    print(f"\nMissing files referenced in the database: {len(report['missing'])}")
+    for path in report['missing']:
+        print(f" - {path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile the uploads directory with the database.")
+    parser.add_argument("--delete", action="store_true", help="Delete orphaned files instead of only reporting them")
+    parser.add_argument("--workers", type=int, default=8, help="Number of scanner threads")
+    parser.add_argument("--grace-minutes", type=int, default=60,
+                        help="Ignore files modified more recently than this")
+    args = parser.parse_args()
+
+    report = reconcile_uploads(workers=args.workers, grace_minutes=args.grace_minutes)
+    print_report(report)
+
+    if args.delete and report['orphans']:
+        freed = delete_orphans(report['orphans'])
+        print(f"\nDeleted {len(report['orphans'])} orphaned files, freed {freed / 1024 / 1024:.2f} MB")
@@ -0,0 +1,328 @@
+import sqlite3
+import os
+import json
+import hashlib
+import threading
+import argparse
+from dotenv import load_dotenv
+
+from gpt_tools import get_gpt4_summary
+from circuit_breaker import CircuitOpenError
+from backoff import retry_delay
+
+# Load environment variables
+load_dotenv()
+
+# Failed summaries are retried with exponential backoff and jitter, then marked failed
+SUMMARY_MAX_ATTEMPTS = int(os.getenv("SUMMARY_MAX_ATTEMPTS", 4))
+SUMMARY_RETRY_BASE_SECONDS = int(os.getenv("SUMMARY_RETRY_BASE_SECONDS", 30))
+SUMMARY_RETRY_MAX_SECONDS = int(os.getenv("SUMMARY_RETRY_MAX_SECONDS", 1800))
+
+SUMMARY_POLL_INTERVAL = 2  # seconds between polls when the queue is empty
+SUMMARY_BATCH_SIZE = 5
+STALE_RUNNING_MINUTES = 10  # jobs claimed by a worker that died are requeued after this
+
+_worker_thread = None
+_worker_lock = threading.Lock()
+_stop_event = threading.Event()
+
+def build_summary_input(referral):
+    """
+    Build the get_gpt4_summary() input from a referrals row.
+
+    Parameters:
+    - referral (dict): A row of the referrals table
+
+    Returns:
+    - dict: The referral fields used in the summary prompt
+    """
+    additional_details = {}
+    if referral.get('additional_details'):
+        try:
+            additional_details = json.loads(referral['additional_details'])
+        except ValueError:
+            additional_details = {}
+
+    return {
+        'patient_name': referral['patient_name'],
+        'patient_age': referral['patient_age'],
+        'patient_gender': referral['patient_gender'],
+        'clinical_information': referral['clinical_information'],
+        'diagnosis': referral['diagnosis'],
+        'reason_for_referral': referral['reason_for_referral'],
+        'medical_history': additional_details.get('medical_history', ""),
+        'medications': additional_details.get('medications', ""),
+        'allergies': additional_details.get('allergies', "")
+    }
+
+def summary_input_hash(summary_input):
+    """Hash of the summary inputs, stored with the summary to detect when it is out of date."""
+    data = json.dumps(summary_input, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def enqueue_summary(c, referral_id):
+    """
+    Queue AI summary generation for a referral using the caller's cursor.
+
+    The job is written in the caller's transaction and the referral is
+    marked pending, so the summary is generated only once the referral
+    has been committed.
+
+    Returns:
+    - int: The job id
+    """
+    c.execute("UPDATE referrals SET gpt_summary_status = 'pending' WHERE referral_id = ?", (referral_id,))
+    c.execute('INSERT INTO summary_jobs (referral_id) VALUES (?)', (referral_id,))
+    return c.lastrowid
+
+def request_summary(referral_id, db_path='referral_system.db'):
+    """
+    Queue (or re-queue) summary generation for an existing referral.
+
+    Returns:
+    - int: The new job id, or the id of a job already waiting for this referral
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.cursor()
+        c.execute('''
+        SELECT id FROM summary_jobs WHERE referral_id = ? AND status IN ('queued', 'running')
+        ''', (referral_id,))
+        existing = c.fetchone()
+        if existing:
+            return existing[0]
+
+        job_id = enqueue_summary(c, referral_id)
+        conn.commit()
+        return job_id
+    finally:
+        conn.close()
+
+def _claim_jobs(conn, batch_size):
+    """Atomically mark up to batch_size queued jobs as running and return (id, referral_id, attempts)."""
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute('''
+        SELECT id, referral_id, attempts + 1 FROM summary_jobs
+        WHERE status = 'queued' AND (next_attempt_at IS NULL OR next_attempt_at <= datetime('now'))
+        ORDER BY id
+        LIMIT ?
+        ''', (batch_size,))
+        rows = c.fetchall()
+
+        if rows:
+            placeholders = ", ".join(["?" for _ in rows])
+            c.execute(f'''
+            UPDATE summary_jobs SET status = 'running', attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+            WHERE id IN ({placeholders})
+            ''', [row[0] for row in rows])
+
+        c.execute("COMMIT")
+        return rows
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+
+def requeue_stale(conn):
+    """Return jobs stuck in 'running' (e.g. after a crash) to the queue."""
+    c = conn.cursor()
+    c.execute('''
+    UPDATE summary_jobs SET status = 'queued'
+    WHERE status = 'running' AND claimed_at < datetime('now', ?)
+    ''', (f'-{STALE_RUNNING_MINUTES} minutes',))
+    conn.commit()
+    return c.rowcount
+
+def _run_job(conn, job_id, referral_id, attempts):
+    """Generate and store one summary, recording the job outcome."""
+    conn.row_factory = sqlite3.Row
+    row = conn.execute('SELECT * FROM referrals WHERE referral_id = ?', (referral_id,)).fetchone()
+    conn.row_factory = None
+    if row is None:
+        conn.execute('''
+        UPDATE summary_jobs SET status = 'failed', last_error = 'Referral not found', finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (job_id,))
+        return False
+
+    referral = dict(row)
+    summary_input = build_summary_input(referral)
+    input_hash = summary_input_hash(summary_input)
+
+    # The stored summary is still valid if the referral data has not changed since it was generated
+    if referral.get('gpt_summary') and referral.get('gpt_summary_hash') == input_hash:
+        conn.execute("BEGIN")
+        conn.execute("UPDATE referrals SET gpt_summary_status = 'ready' WHERE referral_id = ?", (referral_id,))
+        conn.execute('''
+        UPDATE summary_jobs SET status = 'done', last_error = NULL, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        ''', (job_id,))
+        conn.execute("COMMIT")
+        return True
+
+    # The API call runs outside any transaction so the database is not locked while waiting
+    try:
+        summary = get_gpt4_summary(summary_input, raise_errors=True)
+    except CircuitOpenError as e:
+        # The provider is down: leave the summary pending and try again once the circuit half-opens,
+        # without using up one of the job's attempts
+        conn.execute('''
+        UPDATE summary_jobs SET status = 'queued', attempts = attempts - 1, last_error = ?,
+                                next_attempt_at = datetime('now', ?)
+        WHERE id = ?
+        ''', (str(e), f'+{int(e.retry_after) + 1} seconds', job_id))
+        return False
+    except Exception as e:
+        if attempts < SUMMARY_MAX_ATTEMPTS:
+            delay = retry_delay(attempts, SUMMARY_RETRY_BASE_SECONDS, SUMMARY_RETRY_MAX_SECONDS)
+            print(f"Summary job {job_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+            conn.execute('''
+            UPDATE summary_jobs SET status = 'queued', last_error = ?, next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+            ''', (str(e), f'+{int(delay)} seconds', job_id))
+        else:
+            print(f"Summary job {job_id} failed after {attempts} attempts: {e}")
+            conn.execute("BEGIN")
+            conn.execute('''
+            UPDATE summary_jobs SET status = 'failed', last_error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            ''', (str(e), job_id))
+            conn.execute("UPDATE referrals SET gpt_summary_status = 'failed' WHERE referral_id = ?", (referral_id,))
+            conn.execute("COMMIT")
+        return False
+
+    conn.execute("BEGIN")
+    conn.execute('''
+    UPDATE referrals SET gpt_summary = ?, gpt_summary_status = 'ready', gpt_summary_hash = ?
+    WHERE referral_id = ?
+    ''', (summary, input_hash, referral_id))
+    conn.execute('''
+    UPDATE summary_jobs SET status = 'done', last_error = NULL, finished_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (job_id,))
+    conn.execute("COMMIT")
+    return True
+
+def process_summary_jobs(batch_size=SUMMARY_BATCH_SIZE, db_path='referral_system.db'):
+    """
+    Generate summaries for one batch of queued jobs.
+
+    Returns:
+    - int: Number of jobs processed
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        rows = _claim_jobs(conn, batch_size)
+        for job_id, referral_id, attempts in rows:
+            _run_job(conn, job_id, referral_id, attempts)
+        return len(rows)
+    finally:
+        conn.close()
+
+def run_worker(poll_interval=SUMMARY_POLL_INTERVAL, stop_event=None, db_path='referral_system.db'):
+    """Process summary jobs until stop_event is set."""
+    stop_event = stop_event or threading.Event()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        requeued = requeue_stale(conn)
+        if requeued:
+            print(f"Requeued {requeued} stale summary jobs")
+    finally:
+        conn.close()
+
+    while not stop_event.is_set():
+        try:
+            processed = process_summary_jobs(db_path=db_path)
+        except Exception as e:
+            print(f"Summary worker error: {e}")
+            processed = 0
+
+        if not processed:
+            stop_event.wait(poll_interval)
+
+def start_summary_worker(poll_interval=SUMMARY_POLL_INTERVAL):
+    """
+    Start the background summary worker once per process.
+
+    Safe to call on every Streamlit rerun: only the first call starts a thread.
+    """
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is not None and _worker_thread.is_alive():
+            return _worker_thread
+
+        _stop_event.clear()
+        _worker_thread = threading.Thread(
+            target=run_worker,
+            kwargs={'poll_interval': poll_interval, 'stop_event': _stop_event},
+            name="summary-worker",
+            daemon=True
+        )
+        _worker_thread.start()
+        return _worker_thread
+
+def stop_summary_worker(timeout=10):
+    """Signal the background worker to stop and wait for it."""
+    _stop_event.set()
+    if _worker_thread is not None:
+        _worker_thread.join(timeout)
+
+def get_summary_job_stats(db_path='referral_system.db'):
+    """
+    Get queue depth and generation latency for the summary job queue.
+
+    Returns:
+    - dict: counts per status, queue depth, age of the oldest pending job
+      and time from referral to finished summary (seconds) over the last 24 hours
+    """
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    c.execute('SELECT status, COUNT(*) FROM summary_jobs GROUP BY status')
+    status_counts = dict(c.fetchall())
+
+    c.execute('''
+    SELECT (julianday('now') - julianday(MIN(created_at))) * 86400
+    FROM summary_jobs WHERE status IN ('queued', 'running')
+    ''')
+    oldest_queued_age = c.fetchone()[0] or 0
+
+    c.execute('''
+    SELECT AVG((julianday(finished_at) - julianday(created_at)) * 86400)
+    FROM summary_jobs
+    WHERE status = 'done' AND finished_at > datetime('now', '-1 day')
+    ''')
+    avg_latency = c.fetchone()[0]
+
+    conn.close()
+    return {
+        'status_counts': status_counts,
+        'queue_depth': sum(status_counts.get(status, 0) for status in ('queued', 'running')),
+        'oldest_queued_age': oldest_queued_age,
+        'avg_generation_latency': avg_latency or 0
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate queued AI referral summaries.")
+    parser.add_argument("--once", action="store_true", help="Process the due jobs and exit")
+    parser.add_argument("--stats", action="store_true", help="Print queue metrics and exit")
+    args = parser.parse_args()
+
+    if args.stats:
+        print(get_summary_job_stats())
+    elif args.once:
+        total = 0
+        while True:
+            processed = process_summary_jobs()
+            if not processed:
+                break
+            total += processed
+        print(f"Processed {total} summary jobs")
+    else:
+        print("Summary worker running, press Ctrl+C to stop")
+        try:
+            run_worker()
+        except KeyboardInterrupt:
+            pass